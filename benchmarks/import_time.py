@@ -0,0 +1,79 @@
+"""
+Measures the import time and memory of each src package in a fresh interpreter, and checks
+that none of them pulls in a heavy dependency at import time (those are imported lazily,
+on first use). Exit status is 1 if a heavy module is imported, or, with --baseline, if an
+import got slower than the threshold allows.
+
+Usage:
+    python benchmarks/import_time.py [--out import_results.json] [--baseline base.json] [--time-threshold 0.3]
+"""
+import os, sys, json, argparse, subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+MODULES = ['Model.BlackBody', 'Star.Star', 'Star.StarCatalog', 'Star.SkyIndex', 'Instrument.Instrument', 'Instrument.Pipeline', 'MyData.MyData', 'Profiler.Profiler']
+
+# must not be imported by merely importing MODULES
+HEAVY = ['matplotlib', 'pandas', 'scipy', 'astropy', 'sklearn']
+
+# runs in the child interpreter; prints a JSON record
+PROBE = '''
+import sys, time, json, resource
+sys.path.insert(0, {src!r})
+import numpy # common to everything; not charged to the module
+rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = time.perf_counter()
+import {module}
+t = time.perf_counter() - t0
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{'time': t, 'maxrss_kb': rss - rss0,
+                  'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+def probe(module, repeat=5):
+    """
+    Returns dict of best import time (s), memory growth (kB) and heavy modules imported, over repeat fresh interpreters.
+    """
+    best = None
+    for _ in range(repeat):
+        code = PROBE.format(src=SRC, module=module, heavy=HEAVY)
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        if best is None or r['time'] < best['time']:
+            best = r
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import-time benchmark for the src packages.')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per module; the best is kept')
+    parser.add_argument('--out', default='import_results.json', help='where to write the results')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--time-threshold', type=float, default=0.3, help='allowed fractional slowdown')
+    args = parser.parse_args(argv)
+
+    results = {}
+    failures = []
+    print(f'{"module":<24} {"import ms":>10} {"RSS MB":>8}  heavy imports')
+    for module in MODULES:
+        r = results[module] = probe(module, args.repeat)
+        print(f'{module:<24} {r["time"]*1e3:>10.1f} {r["maxrss_kb"]/1024:>8.1f}  {", ".join(r["heavy"])}')
+        if r['heavy']:
+            failures.append(f'{module} imports {", ".join(r["heavy"])} at import time')
+
+    with open(args.out, 'w') as f:
+        json.dump({'results': results}, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        for module, r in results.items():
+            if module in baseline and r['time'] > (1 + args.time_threshold)*baseline[module]['time']:
+                failures.append(f'{module}: import {r["time"]/baseline[module]["time"]:.2f}x baseline')
+
+    if failures:
+        print('\nFailures:\n  ' + '\n  '.join(failures))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
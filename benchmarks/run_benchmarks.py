@@ -0,0 +1,255 @@
+"""
+Benchmark suite for the hot paths in src/. Times each case (best of --repeat runs) and
+measures its peak traced memory, on synthetic data at several sizes, and writes the
+results as JSON. With --baseline, results are compared against a previous run and the
+exit status is 1 if any case got slower (or used more memory) than the thresholds allow.
+
+Usage:
+    python benchmarks/run_benchmarks.py                        # run, print, write benchmark_results.json
+    python benchmarks/run_benchmarks.py --quick                # smallest size of each case only
+    python benchmarks/run_benchmarks.py --baseline base.json --time-threshold 0.25
+    python benchmarks/run_benchmarks.py -k smoother            # only cases whose name contains 'smoother'
+"""
+import os, sys, time, json, argparse, platform, tempfile, tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Model.BlackBody import BlackBody, planck_cache
+from Star.Star import Star
+from Instrument.Instrument import Instrument
+from MyData.MyData import MyData
+from Star.StarCatalog import sexagesimal_to_rad
+from Star.SkyIndex import SkyIndex
+
+# registry of benchmark cases: name -> (sizes, setup(size, tmpdir) -> run())
+CASES = {}
+
+def case(name, sizes):
+    """
+    Decorator registering a benchmark. The decorated function gets (size, tmpdir), prepares
+    the inputs and returns the zero-argument callable to be timed.
+    """
+    def register(setup):
+        CASES[name] = (sizes, setup)
+        return setup
+    return register
+
+def _sun():
+    return Star('Sun at 10 pc', ra='00:00:00', dec='+00:00:00', distance=10, mass=1, teff=5780, radius=1.0)
+
+@case('blackbody_intensity', sizes=[10**3, 10**5, 10**6])
+def bench_blackbody_intensity(size, tmpdir):
+    bb = BlackBody('sun', 5780)
+    lam = np.linspace(100, 3000, size)/1e9
+    return lambda: bb.intensity(lam)
+
+@case('blackbody_flux', sizes=[10**3, 10**5, 10**6])
+def bench_blackbody_flux(size, tmpdir):
+    bb = BlackBody('sun', 5780)
+    lam = np.linspace(100, 3000, size)/1e9
+    return lambda: bb.flux(lam)
+
+@case('star_flux_spectrum', sizes=[10**3, 10**5, 10**6])
+def bench_star_flux_spectrum(size, tmpdir):
+    star = _sun()
+    lam = np.linspace(100, 3000, size)/1e9
+    def run():
+        planck_cache.clear() # time the uncached spectrum
+        star.flux_spectrum(lam)
+    return run
+
+@case('instrument_simulate', sizes=[100, 10**4, 10**6])
+def bench_instrument_simulate(size, tmpdir):
+    star = _sun()
+    inst = Instrument(name='bench', nlam=size, lam_min=300, lam_max=2100, diameter=2.4, efficiency=0.6)
+    np.random.seed(0)
+    def run():
+        planck_cache.clear()
+        inst.simulate(star, 1e4)
+    return run
+
+def _sky(size):
+    rng = np.random.default_rng(0)
+    return rng.uniform(0, 360, size), np.degrees(np.arcsin(rng.uniform(-1, 1, size)))
+
+@case('sexagesimal_to_rad', sizes=[10**3, 10**5, 10**6])
+def bench_sexagesimal_to_rad(size, tmpdir):
+    ra, dec = _sky(size)
+    h, m = divmod(ra/15*60, 60)
+    values = [f'{int(a):02d}:{int(b):02d}:{(b%1)*60:07.4f}' for a, b in zip(h, m)]
+    return lambda: sexagesimal_to_rad(values, hours=True)
+
+@case('skyindex_cone', sizes=[10**4, 10**6])
+def bench_skyindex_cone(size, tmpdir):
+    index = SkyIndex(*_sky(size))
+    pointings = _sky(1000)
+    return lambda: index.cone(*pointings, 0.5)
+
+@case('skyindex_crossmatch', sizes=[10**4, 10**6])
+def bench_skyindex_crossmatch(size, tmpdir):
+    ra, dec = _sky(size)
+    index = SkyIndex(ra, dec)
+    return lambda: index.crossmatch(ra + 1e-4, dec, 1/3600.)
+
+def _image(size):
+    return np.random.default_rng(0).normal(1000, 50, (size, size)).astype(np.int16)
+
+for _sigma in [1, 5]:
+    @case(f'smoother_gaussian_sigma{_sigma}', sizes=[256, 1024, 2048])
+    def bench_smoother_gaussian_sigma(size, tmpdir, sigma=_sigma):
+        d = MyData()
+        d.array = _image(size)
+        return lambda: d.smoother('gaussian', sigma)
+
+for _n in [3, 15, 45]:
+    @case(f'smoother_convolve_n{_n}', sizes=[256, 1024, 2048])
+    def bench_smoother_convolve_n(size, tmpdir, n=_n):
+        d = MyData()
+        d.array = _image(size)
+        return lambda: d.smoother('convolve', n)
+
+@case('masked_reductions', sizes=[10**5, 10**7])
+def bench_masked_reductions(size, tmpdir):
+    d = MyData()
+    d.y = np.random.default_rng(0).normal(5, 2, size)
+    d.SetValid('y', np.random.default_rng(1).random(size) > 0.1)
+    return lambda: (d.Mean('y'), d.Std('y'), d.Min('y'), d.ArgMin('y'))
+
+def _table(size, tmpdir):
+    filename = os.path.join(tmpdir, f'table_{size}.txt')
+    if not os.path.exists(filename):
+        d = MyData()
+        d.x = np.random.default_rng(0).random(size); d.nx = size
+        d.y = np.random.default_rng(1).random(size); d.ny = size
+        d.WriteTableData(filename)
+    return filename
+
+@case('GetTableData', sizes=[10**4, 10**5, 10**6])
+def bench_GetTableData(size, tmpdir):
+    filename = _table(size, tmpdir)
+    return lambda: MyData().GetTableData(filename)
+
+@case('WriteTableData', sizes=[10**4, 10**5, 10**6])
+def bench_WriteTableData(size, tmpdir):
+    d = MyData()
+    d.x = np.random.default_rng(0).random(size); d.nx = size
+    d.y = np.random.default_rng(1).random(size); d.ny = size
+    filename = os.path.join(tmpdir, 'written.txt')
+    return lambda: d.WriteTableData(filename)
+
+def _int16_file(size, tmpdir):
+    filename = os.path.join(tmpdir, f'image_{size}.dat')
+    if not os.path.exists(filename):
+        _image(size).tofile(filename)
+    return filename
+
+@case('ReadInteger16', sizes=[256, 1024, 4096])
+def bench_ReadInteger16(size, tmpdir):
+    filename = _int16_file(size, tmpdir)
+    def run():
+        d = MyData()
+        d.ReadInteger16(filename, size, size)
+        d.array.sum() # touch every pixel
+    return run
+
+@case('GetFits', sizes=[256, 1024, 4096])
+def bench_GetFits(size, tmpdir):
+    from astropy.io import fits
+    filename = os.path.join(tmpdir, f'image_{size}.fits')
+    if not os.path.exists(filename):
+        fits.PrimaryHDU(_image(size)).writeto(filename)
+    def run():
+        d = MyData()
+        d.GetFits(filename)
+        d.array.sum() # touch every pixel
+    return run
+
+def measure(run, repeat):
+    """
+    Returns (best wall time in seconds over repeat runs, peak traced memory in bytes of one run).
+    """
+    run() # warm up
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+def run_suite(select=None, quick=False, repeat=5):
+    """
+    Runs the selected benchmark cases. Returns dict of 'name[size]' -> {'time': s, 'peak_bytes': n}.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, (sizes, setup) in CASES.items():
+            if select and not any(s in name for s in select):
+                continue
+            for size in (sizes[:1] if quick else sizes):
+                run = setup(size, tmpdir)
+                t, peak = measure(run, repeat)
+                key = f'{name}[{size}]'
+                results[key] = {'time': t, 'peak_bytes': peak}
+                print(f'{key:<40} {t*1e3:>12.3f} ms {peak/2**20:>10.2f} MiB', flush=True)
+    return results
+
+def compare(results, baseline, time_threshold, memory_threshold):
+    """
+    Compares results against baseline results. Returns list of regression messages.
+    A case regresses if its time (peak memory) exceeds the baseline by more than
+    time_threshold (memory_threshold), given as a fraction.
+    """
+    regressions = []
+    print(f'\n{"case":<40} {"time ratio":>12} {"memory ratio":>14}')
+    for key, r in results.items():
+        b = baseline.get(key)
+        if b is None:
+            continue
+        t_ratio = r['time']/b['time']
+        m_ratio = r['peak_bytes']/b['peak_bytes'] if b['peak_bytes'] else 1.0
+        flag = ''
+        if t_ratio > 1 + time_threshold:
+            regressions.append(f'{key}: time {t_ratio:.2f}x baseline')
+            flag += ' TIME'
+        if m_ratio > 1 + memory_threshold:
+            regressions.append(f'{key}: peak memory {m_ratio:.2f}x baseline')
+            flag += ' MEMORY'
+        print(f'{key:<40} {t_ratio:>12.2f} {m_ratio:>14.2f}{flag}')
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths in src/.')
+    parser.add_argument('-k', dest='select', action='append', help='only run cases whose name contains this (repeatable)')
+    parser.add_argument('--quick', action='store_true', help='only the smallest size of each case')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per case; the best is kept')
+    parser.add_argument('--out', default='benchmark_results.json', help='where to write the results')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--time-threshold', type=float, default=0.2, help='allowed fractional slowdown')
+    parser.add_argument('--memory-threshold', type=float, default=0.2, help='allowed fractional peak memory growth')
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.select, args.quick, args.repeat)
+
+    out = {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                    'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+           'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(out, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.time_threshold, args.memory_threshold)
+        if regressions:
+            print('\nRegressions:\n  ' + '\n  '.join(regressions))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Times the MyData.smoother convolution methods against kernel size to locate the
+crossover points used by method='auto'.
+
+Usage: python benchmarks/smoother_crossover.py [image size]
+"""
+import os, sys, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from MyData.MyData import MyData
+
+def best_time(func, repeat=3):
+    """
+    Returns the fastest of repeat wall-clock timings of func(), in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+def crossover(npix=1000, sizes=(1, 3, 5, 7, 9, 11, 15, 21, 31, 45)):
+    """
+    Returns a list of (kernel size, {method: seconds}) for box and random kernels.
+    """
+    rng = np.random.default_rng(0)
+    d = MyData()
+    d.array = rng.normal(size=(npix, npix))
+
+    results = []
+    for n in sizes:
+        kernel = rng.random((n, n))
+        row = {}
+        for method in ('box', 'fft', 'direct'):
+            row[f'box/{method}'] = best_time(lambda: d.smoother('convolve', n, method=method))
+        for method in ('fft', 'direct'):
+            row[f'random/{method}'] = best_time(lambda: d.smoother('convolve', kernel, method=method))
+        results.append((n, row))
+    return results
+
+if __name__ == "__main__":
+    npix = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    results = crossover(npix)
+
+    cols = list(results[0][1].keys())
+    print(f'{npix}x{npix} image, best of 3, milliseconds')
+    print(f'{"n":>4} ' + ' '.join(f'{c:>14}' for c in cols))
+    for n, row in results:
+        print(f'{n:>4} ' + ' '.join(f'{row[c]*1e3:>14.1f}' for c in cols))
+
+    #smallest n from which FFT wins at every larger size too, so one noisy win does not count
+    crossover_n = None
+    for n, row in reversed(results):
+        if row['random/fft'] >= row['random/direct']:
+            break
+        crossover_n = n
+    if crossover_n is not None:
+        print(f'FFT beats direct for every n >= {crossover_n} ({crossover_n**2} kernel elements); '
+              f'MyData._fft_kernel_size = {MyData._fft_kernel_size} (FFT from that many elements)')
+    else:
+        print('FFT does not beat direct at the largest kernel size')
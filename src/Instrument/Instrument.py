@@ -1,16 +1,18 @@
 
 import numpy as np
-import matplotlib.pyplot as plt
 import sys
 
 if __name__ == "__main__":
     sys.path.insert(0, r'ASTR3800\src')
 
 from Star.Star import Star
+from Star.StarCatalog import StarCatalog
+from Model.BlackBody import PlanckCache
+from Profiler.Profiler import hotpath
 
 class Instrument():
     def __init__(self,name='Unnamed', nlam = 100, lam_min = 100., lam_max = 1000.,
-                 diameter = 1., efficiency=1.00):
+                 diameter = 1., efficiency=1.00, throughput=None):
         """
         Constructs an Instrument object.
 
@@ -20,17 +22,23 @@ class Instrument():
             lam_min, lam_max: float; wavelength minimum and maximum, NANOMETERS
             diameter: float, diameter of instrument in meters
             efficiency: float (0,1): efficiency of the instrument
+            throughput: wavelength-dependent efficiency used by the response operator; either a
+                callable of wavelength in nm, or a tuple (lam_nm, efficiency) of arrays to interpolate.
+                Default: efficiency at every wavelength
         """
         self.name = name
         self.nlam = nlam
         self.lam_min = lam_min
         self.lam_max = lam_max
         self.lam = np.linspace(lam_min, lam_max, nlam )
-        self.lambin = (lam_max-lam_min)/float(nlam) #binwidth in nm
+        #binwidth in nm: the spacing of the bin centers, which run from lam_min to lam_max
+        self.lambin = (lam_max-lam_min)/float(max(nlam-1, 1))
         self.diameter = diameter # meters
         self.efficiency = efficiency
         self.area = (np.pi/4)*diameter**2 #in m^2
         self.eff_area = self.area*efficiency
+        self.throughput = throughput
+        self._response = None # (wavelength grid fingerprint, response matrix)
 
 
 
@@ -54,21 +62,145 @@ class Instrument():
         nm_per_meter = 1e9
         return self.lambin/nm_per_meter
 
-    def simulate(self, star:Star, obstime:float, obstype:str='photon_counts'):
+    def bin_edges_m(self):
+        """
+        Returns array(nlam+1,) of wavelength bin edges in meters: binwidth_m() wide bins centered
+        on the bin centers.
+        """
+        width = self.binwidth_m()
+        return self.lam_meters()[0] + width*(np.arange(self.nlam+1) - 0.5)
+
+    def response_grid(self, oversample:int=10):
+        """
+        Returns an evenly spaced wavelength grid (meters) spanning the bin edges with oversample points per bin,
+        suitable for evaluating spectra to be passed to counts().
+        """
+        edges = self.bin_edges_m()
+        return np.linspace(edges[0], edges[-1], self.nlam*oversample+1)
+
+    def throughput_curve(self, lmbda):
+        """
+        Returns the instrument efficiency at wavelengths lmbda (meters).
+        """
+        nm_per_meter = 1e9
+        if self.throughput is None:
+            return np.full(len(lmbda), self.efficiency)
+        if callable(self.throughput):
+            return np.asarray(self.throughput(lmbda*nm_per_meter), dtype=float)*np.ones(len(lmbda))
+        lam_nm, eff = self.throughput
+        return np.interp(lmbda*nm_per_meter, lam_nm, eff, left=0.0, right=0.0)
+
+    def response(self, lmbda):
+        """
+        Returns the response matrix R, array(nlam, n), mapping a flux spectrum sampled at wavelengths
+        lmbda (meters, increasing) to photon counts per second in each instrument bin: counts = R @ spectrum.
+
+        Each row holds the quadrature weights of the exact integral of the piecewise-linear spectrum
+        over that bin, times throughput, collecting area and photons per Joule (lambda/hc).
+        The matrix for the most recent grid is cached.
+        """
+        mylmbda = np.asarray(lmbda, dtype=float)
+        key = PlanckCache.fingerprint(mylmbda)
+        if self._response is not None and self._response[0] == key:
+            return self._response[1]
+
+        c = 2.99792e+08 # m s^-1
+        h = 6.62607e-34  # J s
+
+        edges = self.bin_edges_m()
+        x0 = mylmbda[:-1]; x1 = mylmbda[1:]; dx = x1-x0
+        #overlap [u, v] of every grid interval with every bin
+        u = np.maximum(x0[np.newaxis, :], edges[:-1, np.newaxis])
+        v = np.minimum(x1[np.newaxis, :], edges[1:, np.newaxis])
+        v = np.maximum(u, v)
+        #integral of the linear interpolant over [u, v], split into weights on the interval's endpoints
+        w_left = ((x1-u)**2 - (x1-v)**2)/(2*dx)
+        w_right = ((v-x0)**2 - (u-x0)**2)/(2*dx)
+
+        R = np.zeros((self.nlam, len(mylmbda)))
+        R[:, :-1] += w_left
+        R[:, 1:] += w_right
+        R *= self.area*self.throughput_curve(mylmbda)*mylmbda/(h*c)
+
+        R.flags.writeable = False
+        self._response = (key, R)
+        return R
+
+    def counts(self, spectra, lmbda, obstime:float):
+        """
+        Returns expected photon counts per bin for flux spectra (W m^-2 m^-1) sampled at lmbda (meters).
+        spectra may be array(n,) or array(nspec, n); the result is array(nlam,) or array(nspec, nlam).
+        """
+        R = self.response(lmbda)
+        return obstime*(np.asarray(spectra) @ R.T)
+
+    def expected_counts(self, star, obstime:float, oversample:int=None):
+        """
+        Computes expected photon counts in each wavelength bin.
+
+        Arguments:
+            star: Star, list of Stars or StarCatalog; the target(s) of observation
+            obstime: float; exposure time in seconds
+            oversample: int; if given, the spectrum is evaluated at oversample points per bin and
+                integrated over each bin with the response operator (flux conserving).
+                Default: flux at the bin centers times the bin width. Both apply the throughput and
+                agree up to the error of sampling the spectrum once per bin
+
+        Returns:
+            array(nlam,) of expected counts for a single Star, array(nstars, nlam) otherwise
+        """
+        if isinstance(star, (list, tuple)):
+            star = StarCatalog.from_stars(star)
+
+        if oversample is not None:
+            lmbda = self.response_grid(oversample)
+            return self.counts(star.flux_spectrum(lmbda = lmbda), lmbda, obstime)
+
+        lam_m = self.lam_meters()
+        bin_width = self.binwidth_m()
+
+        #get the star's flux spectrum (returned as Watts/labmda which is J/(second lambda))
+        flux_spectrum = star.flux_spectrum(lmbda = lam_m)
+        #bin-ify the spectrum
+        # already done from above
+
+        #get Joules
+        joules_spectrum = obstime*flux_spectrum*self.area*self.throughput_curve(lam_m)
+
+        #convert to photons
+        c = 2.99792e+08 # m s^-1
+        h = 6.62607e-34  # J s
+
+        expected_photon_counts = bin_width*joules_spectrum/(h*c/lam_m)
+        return expected_photon_counts
+
+    @hotpath('compute')
+    def simulate(self, star:Star, obstime:float, obstype:str='photon_counts',
+                 ntrials:int=None, rng:np.random.Generator=None, keep_trials:bool=True, chunksize:int=1024,
+                 oversample:int=None):
         """
         simulates observation of star for obstime seconds.
 
         Arguments:
-            star: star object; the target of observation/simulation
+            star: star object; the target of observation/simulation. May also be a list of
+                stars or a StarCatalog, in which case results get a leading star axis.
             obstime: float; exposure time in seconds
             obstype: string {'photon_counts' 'flux'} specifies whether to comupte photon counts or flux
+            ntrials: int; number of independent realizations to draw. Default (None) draws a single one.
+            rng: numpy.random.Generator used for the poisson draws. Default: the global numpy.random state.
+            keep_trials: bool; if False (and ntrials is given), only the per-bin mean and standard deviation
+                of the realizations are returned, accumulated chunksize trials at a time.
+            chunksize: int; number of trials drawn per block when keep_trials is False
+            oversample: int; see expected_counts
 
         Returns:
             dict of simulation results:
                 "lmbda": wavelength bin centers in nanometers
                 "expected": photon counts in bins
                 "error": +/- 1 standard deviation from expected count
-                "simulated": poisson simulated photon counts, mu=expected
+                "simulated": poisson simulated photon counts, mu=expected;
+                    shape (ntrials,)+expected.shape if ntrials is given, omitted if keep_trials is False
+                "sim_mean", "sim_std": mean and standard deviation over trials (only if ntrials is given)
         """
 
         if obstype != 'flux' and obstype != 'photon_counts':
@@ -77,43 +209,54 @@ class Instrument():
         if obstype != 'photon_counts':
             raise ValueError('Only \'photon_counts\' implemeneted at this time.')
 
+        if ntrials is not None and ntrials < 1:
+            raise ValueError(f'Invalid ntrials: {ntrials}, must be positive')
+
         #save the arguments for later
         self.target = star
         self.obstime = obstime
         self.obstype = obstype
 
-        lam_m = self.lam_meters()
-        bin_width = self.binwidth_m()
-
-        #get the star's flux spectrum (returned as Watts/labmda which is J/(second lambda))
-        flux_spectrum = star.flux_spectrum(lmbda = lam_m)
-        #bin-ify the spectrum
-        # already done from above
+        expected_photon_counts = self.expected_counts(star, obstime, oversample=oversample)
 
-        #get Joules
-        joules_spectrum = obstime*flux_spectrum*self.area/self.nlam
-
-        #convert to photons
-        c = 2.99792e+08 # m s^-1
-        h = 6.62607e-34  # J s
-   
-
-        expected_photon_counts = bin_width*joules_spectrum/(h*c/lam_m)
+        poisson = rng.poisson if rng is not None else np.random.poisson
 
         #add poisson random component
-        simulated_photon_counts = np.random.poisson(lam=expected_photon_counts,size=self.nlam)
+        if ntrials is None:
+            simulated_photon_counts = poisson(lam=expected_photon_counts,size=expected_photon_counts.shape)
+        elif keep_trials:
+            simulated_photon_counts = poisson(lam=expected_photon_counts,size=(ntrials,)+expected_photon_counts.shape)
+        else:
+            #accumulate running sums so that only chunksize realizations are held at once
+            total = np.zeros(expected_photon_counts.shape)
+            total_sq = np.zeros(expected_photon_counts.shape)
+            for start in range(0, ntrials, chunksize):
+                n = min(chunksize, ntrials-start)
+                block = poisson(lam=expected_photon_counts,size=(n,)+expected_photon_counts.shape).astype(float)
+                total += block.sum(axis=0)
+                total_sq += np.square(block).sum(axis=0)
+            sim_mean = total/ntrials
+            sim_std = np.sqrt(np.maximum(total_sq/ntrials - sim_mean**2, 0.0))
 
         #return result
 
         self.simresult = {'lmbda':self.lam, #note nanometers
                 'expected': expected_photon_counts,
                 'error': np.sqrt(expected_photon_counts),
-                'simulated':simulated_photon_counts
                 }
+        if ntrials is None or keep_trials:
+            self.simresult['simulated'] = simulated_photon_counts
+        if ntrials is not None:
+            if keep_trials:
+                sim_mean = simulated_photon_counts.mean(axis=0)
+                sim_std = simulated_photon_counts.std(axis=0)
+            self.simresult['sim_mean'] = sim_mean
+            self.simresult['sim_std'] = sim_std
 
         return self.simresult
 
     def plotsim(self, **kwargs):
+        import matplotlib.pyplot as plt
 
         sim = kwargs.pop('sim', None)
         obstime = kwargs.pop('obstime', None)
@@ -126,11 +269,19 @@ class Instrument():
         obstime = obstime if obstime is not None else self.obstime
         target = self.target
 
+        if np.ndim(sim['expected']) != 1:
+            raise ValueError(f'Cannot plot results for {np.shape(sim["expected"])[0]} stars; simulate a single Star to plot it')
+
         ax.plot(sim['lmbda'], sim['expected'], label='Expected Photon Count', drawstyle='steps', lw=5)
         ax.plot(sim['lmbda'], sim['expected']+sim['error'], drawstyle='steps', lw=1, color='black')
         ax.plot(sim['lmbda'], sim['expected']-sim['error'], drawstyle='steps', lw=1, color='black', label='+/- Error')
 
-        ax.plot(sim['lmbda'], sim['simulated'], ls='None', marker='o', label='Simulated Photon Count')
+        if 'sim_mean' not in sim:
+            ax.plot(sim['lmbda'], sim['simulated'], ls='None', marker='o', label='Simulated Photon Count')
+        else:
+            #several trials (simulate(..., ntrials=n)): show their mean and spread
+            ax.errorbar(sim['lmbda'], sim['sim_mean'], yerr=sim['sim_std'], ls='None', marker='o',
+                        label='Simulated Photon Count (mean +/- std)')
 
         ax.legend()
         ax.set_ylabel('Photons per Wavelength Bin')
@@ -0,0 +1,165 @@
+import os
+import json
+import numpy as np
+
+from Star.StarCatalog import count_rows, iter_catalog
+
+def _observe_chunk(instrument, obstime, catalog, start, seedseq, outdir, products, oversample):
+    """
+    Observes one chunk of a catalog and writes its rows of each product into the output memmaps.
+    Module level so process pools can pickle it. Returns start.
+    """
+    expected = instrument.expected_counts(catalog, obstime, oversample=oversample)
+    rows = slice(start, start+len(catalog))
+    for product in products:
+        if product == 'expected':
+            block = expected
+        elif product == 'simulated':
+            block = np.random.default_rng(seedseq).poisson(expected)
+        else:
+            block = catalog.flux_spectrum(lmbda=instrument.lam_meters())
+        out = np.load(os.path.join(outdir, f'{product}.npy'), mmap_mode='r+')
+        out[rows] = block
+        out.flush()
+        del out
+    return start
+
+class CatalogPipeline():
+    """
+    Streams a star catalog through an Instrument: reads the catalog chunksize stars at a time,
+    computes each chunk's flux spectra and expected and simulated photon counts, and writes them
+    into memory-mapped .npy files, so memory use does not depend on the size of the catalog.
+    Completed chunks are recorded in a checkpoint, and an interrupted run picks up where it stopped.
+    """
+    products = ('flux', 'expected', 'simulated')
+
+    def __init__(self, instrument, obstime, outdir, products=('expected', 'simulated'),
+                 chunksize=100000, workers=1, seed=None, oversample=None):
+        """
+        Constructs a CatalogPipeline object.
+
+        Arguments:
+            instrument: Instrument observing the catalog
+            obstime: float, exposure time in seconds
+            outdir: str, directory for the outputs, <product>.npy arrays (nstars, nlam), and checkpoint.json
+            products: tuple of str, any of 'flux' (W m^-2 m^-1 at the bin centers), 'expected', 'simulated'
+            chunksize: int, stars per chunk
+            workers: int, number of worker processes
+            seed: int, seed for the simulated counts; each chunk draws from its own stream, so the
+                result does not depend on workers or on interruptions
+            oversample: int, see Instrument.expected_counts
+        """
+        for product in products:
+            if product not in CatalogPipeline.products:
+                raise ValueError(f'Invalid product: {product}, must be one of {", ".join(CatalogPipeline.products)}')
+        self.instrument = instrument
+        self.obstime = obstime
+        self.outdir = outdir
+        self.products = tuple(products)
+        self.chunksize = chunksize
+        self.workers = workers
+        self.seed = seed
+        self.oversample = oversample
+
+    def __repr__(self):
+        return f'CatalogPipeline object; instrument: {self.instrument.name}, outdir: {self.outdir}, products: {self.products}'
+
+    def _checkpoint_file(self):
+        return os.path.join(self.outdir, 'checkpoint.json')
+
+    def _config(self, filename, nstars):
+        # everything the outputs depend on; a checkpoint is only resumed if this matches
+        inst = self.instrument
+        return {'catalog': os.path.abspath(filename), 'nstars': nstars, 'chunksize': self.chunksize,
+                'products': list(self.products), 'obstime': self.obstime, 'oversample': self.oversample, 'seed': self.seed,
+                'instrument': [inst.name, inst.nlam, inst.lam_min, inst.lam_max, inst.diameter, inst.efficiency]}
+
+    def _save_checkpoint(self, state):
+        #write then rename, so an interruption never leaves a partial checkpoint
+        tmp = self._checkpoint_file() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self._checkpoint_file())
+
+    def _start(self, filename, resume):
+        # loads the checkpoint, or creates the outputs and a fresh checkpoint
+        nstars = count_rows(filename)
+        config = self._config(filename, nstars)
+        if resume and os.path.isfile(self._checkpoint_file()):
+            with open(self._checkpoint_file()) as f:
+                state = json.load(f)
+            if state['config'] != config:
+                raise ValueError(f'Checkpoint in {self.outdir} is for a different run; use resume=False to start over')
+            return state
+
+        os.makedirs(self.outdir, exist_ok=True)
+        dtypes = {'flux': np.float64, 'expected': np.float64, 'simulated': np.int64}
+        for product in self.products:
+            out = np.lib.format.open_memmap(os.path.join(self.outdir, f'{product}.npy'), mode='w+',
+                                            dtype=dtypes[product], shape=(nstars, self.instrument.nlam))
+            del out
+        entropy = self.seed if self.seed is not None else np.random.SeedSequence().entropy
+        state = {'config': config, 'entropy': entropy, 'done': []}
+        self._save_checkpoint(state)
+        return state
+
+    def run(self, filename, resume=True):
+        """
+        Observes every star in a catalog file (see StarCatalog.iter_catalog for the formats).
+
+        Arguments:
+            filename: str, CSV or FITS catalog
+            resume: bool, continue from the checkpoint in outdir if there is one for this run;
+                if False, the outputs are started over
+        Returns:
+            dict of product -> read-only memmap array(nstars, nlam)
+        """
+        state = self._start(filename, resume)
+        done = set(state['done'])
+
+        def tasks():
+            #skip over the leading completed chunks without parsing them
+            first = 0
+            while first in done:
+                first += self.chunksize
+            starts = range(first, state['config']['nstars'], self.chunksize)
+            for start, catalog in zip(starts, iter_catalog(filename, self.chunksize, start=first)):
+                #the outputs were sized by count_rows; never write a chunk into the wrong rows
+                expected = min(self.chunksize, state['config']['nstars'] - start)
+                if len(catalog) != expected:
+                    raise ValueError(f'{filename} has {len(catalog)} rows at row {start}, expected {expected}; has the file changed?')
+                if start not in done:
+                    seedseq = np.random.SeedSequence(state['entropy'], spawn_key=(start//self.chunksize,))
+                    yield (self.instrument, self.obstime, catalog, start, seedseq, self.outdir,
+                           self.products, self.oversample)
+
+        def finished(start):
+            done.add(start)
+            state['done'] = sorted(done)
+            self._save_checkpoint(state)
+
+        if self.workers > 1:
+            from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+            with ProcessPoolExecutor(max_workers=self.workers) as ex:
+                pending = set()
+                for task in tasks():
+                    #bound the chunks in flight so memory stays constant
+                    if len(pending) >= 2*self.workers:
+                        complete, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for fut in complete:
+                            finished(fut.result())
+                    pending.add(ex.submit(_observe_chunk, *task))
+                for fut in wait(pending)[0]:
+                    finished(fut.result())
+        else:
+            for task in tasks():
+                finished(_observe_chunk(*task))
+
+        return self.results()
+
+    def results(self):
+        """
+        Returns dict of product -> read-only memmap array(nstars, nlam) of the outputs.
+        """
+        return dict([(product, np.load(os.path.join(self.outdir, f'{product}.npy'), mmap_mode='r'))
+                     for product in self.products])
@@ -1,6 +1,7 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.decomposition import non_negative_factorization
+import hashlib
+import threading
+from collections import OrderedDict
 
 # import sys
 # sys.path.append(r'C:\Users\Kevin\repos\ASTR3800\src')
@@ -10,6 +11,205 @@ if __name__ == "__main__":
 else:
     from Model.Model import Model
 
+def planck_intensity(temp, lmbda, chunksize=None):
+    """
+    Computes the Planck function for many temperatures in one call.
+
+    Arguments:
+        temp: float or array(m,) float; temperature(s), K
+        lmbda: array(n,) float; wavelength in meters
+        chunksize: int; number of temperatures evaluated per block. Each block is
+            computed in place in the output, so smaller blocks keep the working set in cache.
+            Default: all temperatures in a single block.
+    returns:
+        intensity: array(m,n) float, one row per temperature (array(n,) if temp is a scalar),
+            watt m^-2 m^-1 steradian^-1
+    """
+    #some constants(mks units)
+    c = 2.99792e+08 #m s^-1; speed of light
+    h = 6.62607e-34 #J s; Planck's constant
+    k = 1.38065e-23 #J k^1- ; Boltzmann's constant
+
+    temps = np.atleast_1d(np.asarray(temp, dtype=float))
+    if temps.ndim != 1:
+        raise ValueError(f'temp must be a scalar or 1-d array, got shape {temps.shape}')
+    mylmbda = np.atleast_1d(np.asarray(lmbda, dtype=float))
+    if mylmbda.ndim != 1:
+        raise ValueError(f'lmbda must be a scalar or 1-d array, got shape {mylmbda.shape}')
+
+    ntemp = len(temps)
+    if chunksize is None:
+        chunksize = max(ntemp, 1)
+    elif chunksize < 1:
+        raise ValueError(f'Invalid chunksize: {chunksize}, must be positive')
+
+    #terms that depend only on wavelength are computed once for all temperatures
+    first_term = (2*h*c**2)/np.power(mylmbda, 5)
+    hc_lk = h*c/(mylmbda*k)
+
+    B_lambda = np.empty((ntemp, len(mylmbda)))
+    with np.errstate(over='ignore'): #exp overflows to inf for cold/short-wavelength cells; 1/inf -> 0
+        for start in range(0, ntemp, chunksize):
+            block = B_lambda[start:start+chunksize]
+            np.multiply(1.0/temps[start:start+chunksize, np.newaxis], hc_lk, out=block)
+            np.exp(block, out=block)
+            block -= 1
+            np.divide(first_term, block, out=block)
+
+    return B_lambda.reshape(np.shape(temp) + np.shape(lmbda))
+
+def planck_flux(temp, lmbda, chunksize=None):
+    """
+    Computes the surface flux (pi * Planck function) for many temperatures in one call.
+
+    Arguments: see planck_intensity
+    returns:
+        flux: array(m,n) float, one row per temperature (array(n,) if temp is a scalar),
+            J m^-2 s^-1 m^-1
+    """
+    f_lmbda = planck_intensity(temp, lmbda, chunksize=chunksize)
+    f_lmbda *= np.pi #See Maoz, p12, eq 2.5
+    return f_lmbda
+
+def _planck_head(x):
+    """
+    Returns the integral from 0 to x of t^3/(exp(t)-1) dt via its Bernoulli series, elementwise.
+    Accurate to double precision for 0 <= x < 2.
+    """
+    x = np.asarray(x, dtype=float)
+    # Bernoulli numbers B_0, B_1, B_2, B_4, ... B_20 (odd ones beyond B_1 vanish)
+    bern = [(0, 1.), (1, -0.5), (2, 1/6), (4, -1/30), (6, 1/42), (8, -1/30), (10, 5/66),
+            (12, -691/2730), (14, 7/6), (16, -3617/510), (18, 43867/798), (20, -174611/330)]
+    head = np.zeros(x.shape)
+    fact = 1.0
+    last = 0
+    for k, b in bern:
+        for j in range(last+1, k+1):
+            fact *= j
+        last = k
+        head += b*x**(k+3)/(fact*(k+3))
+    return head
+
+def _planck_tail(x):
+    """
+    Returns the integral from x to infinity of t^3/(exp(t)-1) dt, elementwise for x >= 0.
+    For x >= 2 the exponential series sum_n exp(-n x)(x^3/n + 3x^2/n^2 + 6x/n^3 + 6/n^4) is used,
+    for x < 2 pi^4/15 minus _planck_head.
+    """
+    x = np.asarray(x, dtype=float)
+    tail = np.zeros(x.shape)
+
+    big = (x >= 2) & np.isfinite(x)
+    xb = x[big]
+    acc = np.zeros(xb.shape)
+    for n in range(1, 21): # exp(-2n) < 1e-17 by n=20
+        acc += np.exp(-n*xb)*(xb**3/n + 3*xb**2/n**2 + 6*xb/n**3 + 6/n**4)
+    tail[big] = acc
+
+    small = x < 2
+    tail[small] = np.pi**4/15 - _planck_head(x[small])
+
+    return tail
+
+def planck_band_flux(temp, lmin=0.0, lmax=np.inf):
+    """
+    Computes the exact integral of the surface flux (pi * Planck function) between two wavelengths
+    via the series form of the Planck integral; no wavelength grid is involved.
+
+    Arguments (broadcast against each other):
+        temp: float or array; temperature(s), K
+        lmin, lmax: float or array; band edges in meters (lmin=0, lmax=inf gives the bolometric flux)
+    returns:
+        band flux, W m^-2
+    """
+    #some constants(mks units)
+    c = 2.99792e+08 #m s^-1; speed of light
+    h = 6.62607e-34 #J s; Planck's constant
+    k = 1.38065e-23 #J k^1- ; Boltzmann's constant
+
+    temp = np.asarray(temp, dtype=float)
+    with np.errstate(divide='ignore'): # lambda = 0 -> x = inf, lambda = inf -> x = 0
+        x_lo = h*c/(np.asarray(lmax, dtype=float)*k*temp)
+        x_hi = h*c/(np.asarray(lmin, dtype=float)*k*temp)
+
+    #flux shortward of lambda is the tail of the integral in x = hc/(lambda k T)
+    x_lo, x_hi = np.broadcast_arrays(x_lo, x_hi)
+    scale = 2*np.pi*k**4*temp**4/(h**3*c**2)
+    integral = np.asarray(_planck_tail(x_lo) - _planck_tail(x_hi))
+    #long-wavelength bands: difference the series from 0 directly rather than two tails near pi^4/15
+    both_small = x_hi < 2
+    integral[both_small] = _planck_head(x_hi[both_small]) - _planck_head(x_lo[both_small])
+    return scale*integral
+
+class PlanckCache():
+    """
+    Bounded LRU cache of flux spectra keyed by (temperature, wavelength-grid fingerprint).
+    Cached spectra are returned read-only; copy them before modifying.
+    """
+    def __init__(self, maxsize=256):
+        """
+        Arguments:
+            maxsize: int, maximum number of spectra kept; least recently used are evicted first
+        """
+        self.maxsize = maxsize
+        self._spectra = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return f'PlanckCache object; ' + ', '.join([f'{k} = {v}' for k, v in self.stats().items()])
+
+    @staticmethod
+    def fingerprint(lmbda):
+        """
+        Returns a hashable digest identifying a wavelength grid by its values.
+        """
+        mylmbda = np.ascontiguousarray(lmbda, dtype=float)
+        return (mylmbda.shape, hashlib.blake2b(mylmbda.tobytes(), digest_size=16).digest())
+
+    def flux(self, temp, lmbda):
+        """
+        Returns the (read-only) flux spectrum for a single temperature, see planck_flux.
+        """
+        key = (float(temp), PlanckCache.fingerprint(lmbda))
+        with self._lock:
+            spec = self._spectra.get(key)
+            if spec is not None:
+                self._spectra.move_to_end(key)
+                self.hits += 1
+                return spec
+            self.misses += 1
+
+        spec = planck_flux(float(temp), lmbda)
+        spec.flags.writeable = False
+
+        with self._lock:
+            self._spectra[key] = spec
+            while len(self._spectra) > self.maxsize:
+                self._spectra.popitem(last=False)
+                self.evictions += 1
+        return spec
+
+    def stats(self):
+        """
+        Returns dict of hit, miss and eviction counts and the current size.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self._spectra), 'maxsize': self.maxsize}
+
+    def clear(self):
+        """
+        Empties the cache and resets the counters.
+        """
+        with self._lock:
+            self._spectra.clear()
+            self.hits = self.misses = self.evictions = 0
+
+# shared by all BlackBody (and Star) objects
+planck_cache = PlanckCache()
+
 class BlackBody(Model):
     def __init__(self, name, temp, lmbda=None):
         self.temp = temp
@@ -38,26 +238,25 @@ class BlackBody(Model):
         returns:
             intensity: array(n,): float, intensity (brightness) at each lambda, watt m^-2 m^-1 steradian^-1
         """
-        #some constants(mks units)
-        c = 2.99792e+08 #m s^-1; speed of light
-        h = 6.62607e-34 #J s; Planck's constant
-        k = 1.38065e-23 #J k^1- ; Boltzmann's constant
-
         mylmbda = self._lmbda(lmbda=lmbda)
-        temp = self.temp
 
-        #construct the intensity (B_lambda) as product of two terms
-        #first term:
-        first_term = (2*h*c**2)/np.power(mylmbda, 5)
-
-        #second term:
-        expnt = h*c/(mylmbda*k*temp)
-        second_term = 1/(np.exp(expnt)-1)
-
-        B_lambda = first_term*second_term #units: J s^-1 m^-2 m^-1 steradian^-1
+        B_lambda = planck_intensity(self.temp, mylmbda) #units: J s^-1 m^-2 m^-1 steradian^-1
 
         return B_lambda
 
+    @staticmethod
+    def batch_flux(temps, lmbda, chunksize=None):
+        """
+        Computes flux spectra for an array of temperatures without constructing a BlackBody per temperature.
+        Arguments:
+            temps: array(m,) float; temperatures, K
+            lmbda: array(n,) float; wavelength in meters
+            chunksize: int; number of temperatures evaluated per block
+        returns:
+            flux: array(m,n) float, J m^-2 s^-1 m^-1
+        """
+        return planck_flux(temps, lmbda, chunksize=chunksize)
+
     def flux(self, lmbda=None):
 
         #self._ intensity is an infintesimally small area on body's surface radiating isotropically
@@ -73,17 +272,30 @@ class BlackBody(Model):
         return f_lmbda
 
 
-    def integrate_spectrum(self, lmbda=None):
+    def cached_flux(self, lmbda=None):
         """
-        Approximates definite integral of flux over frequency range. Returns result.
+        Same as flux, but looked up in (and added to) planck_cache. The returned array is read-only.
+        """
+        mylmbda = self._lmbda(lmbda=lmbda)
+        return planck_cache.flux(self.temp, mylmbda)
 
+    def integrate_spectrum(self, lmbda=None):
+        """
+        Computes the definite integral of flux over the wavelength range of lmbda (meters). Returns result, W m^-2.
+        The integral is exact (see planck_band_flux); only the end points of lmbda are used.
         """
         mylmbda = self._lmbda(lmbda=lmbda)
-        flux = self.flux(lmbda=mylmbda)
 
-        bolo_flux = np.trapz(flux, self.lmbda)
+        bolo_flux = planck_band_flux(self.temp, np.min(mylmbda), np.max(mylmbda))
         return bolo_flux
 
+    def band_flux(self, lmin=0.0, lmax=np.inf):
+        """
+        Computes the exact flux between wavelengths lmin and lmax (meters, may be arrays of band edges), W m^-2.
+        The defaults give the bolometric flux, sigma*T^4.
+        """
+        return planck_band_flux(self.temp, lmin, lmax)
+
     def Wien(self):
         """
         Computes and returns wavelength (in m) of maximum flux given star's temperature
@@ -93,6 +305,7 @@ class BlackBody(Model):
         return lmbda_max
 
     def plot_spectrum(self, **kwargs):
+        import matplotlib.pyplot as plt
         ax = kwargs.pop('ax', None)
         title = kwargs.pop('title', self.name)
         label = kwargs.pop('label', f'Planck teff={self.temp}')
@@ -120,7 +333,7 @@ class BlackBody(Model):
         ax.set_title(title)
 
 if __name__ == "__main__":
-
+    import matplotlib.pyplot as plt
 
     b_sun = BlackBody('sun', 5780)
     lam_min = 100.; lam_max = 1000.; nlam=100
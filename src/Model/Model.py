@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 class Model:
@@ -22,6 +21,7 @@ class Model:
         self.dx = (xmax-xmin)/(npt)
         
     def PlotModel(self):
+        import matplotlib.pyplot as plt
         plt.title(self.name)
         plt.plot(self.x,self.y)
         plt.show()
@@ -0,0 +1,120 @@
+import numpy as np
+
+class Histogram():
+    """
+    Fixed-bin histogram that is filled incrementally, so the samples never have to be
+    held in memory at once. Histograms with the same bins can be merged, e.g. across workers.
+    """
+    def __init__(self, bins=10, range=None):
+        """
+        Constructs a Histogram object.
+
+        Arguments:
+            bins: int, number of equal-width bins over range; or array(nbins+1,) of increasing bin edges
+            range: (float, float), lower and upper edge; required if bins is an int. Like np.histogram,
+                a zero-width range is widened to +/- 0.5
+        """
+        if np.ndim(bins) == 0:
+            if range is None:
+                raise ValueError('range is required when bins is a number of bins')
+            lo, hi = float(range[0]), float(range[1])
+            if lo > hi or not (np.isfinite(lo) and np.isfinite(hi)):
+                raise ValueError(f'Invalid range: {range}, must be finite with lower <= upper')
+            if lo == hi:
+                lo, hi = lo - 0.5, hi + 0.5
+            self.edges = np.linspace(lo, hi, int(bins)+1)
+            self.uniform = True
+        else:
+            self.edges = np.asarray(bins, dtype=float)
+            if self.edges.ndim != 1 or len(self.edges) < 2 or np.any(np.diff(self.edges) <= 0):
+                raise ValueError('bins must be a 1-d array of increasing edges')
+            self.uniform = False
+
+        self.nbins = len(self.edges) - 1
+        self.counts = np.zeros(self.nbins, dtype=np.int64)
+        self.underflow = 0 # samples below the first edge
+        self.overflow = 0  # samples above the last edge (or NaN)
+        # running moments of the binned samples
+        self.n = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+
+    def __repr__(self):
+        return f'Histogram object: {self.nbins} bins [{self.edges[0]}, {self.edges[-1]}], {self.n} samples'
+
+    def add(self, values):
+        """
+        Adds a chunk of samples to the histogram. Like np.histogram, bins are half-open
+        except the last, which includes its right edge.
+        """
+        v = np.asarray(values, dtype=float).ravel()
+        lo, hi = self.edges[0], self.edges[-1]
+
+        inside = (v >= lo) & (v <= hi)
+        v_in = v[inside]
+        if self.uniform:
+            idx = ((v_in - lo)*(self.nbins/(hi - lo))).astype(np.intp)
+            np.minimum(idx, self.nbins-1, out=idx) # right edge goes in the last bin
+            #fix samples that rounding put one bin off
+            idx -= v_in < self.edges[idx]
+            idx += (v_in >= self.edges[idx+1]) & (idx < self.nbins-1)
+        else:
+            idx = np.searchsorted(self.edges, v_in, side='right') - 1
+            np.minimum(idx, self.nbins-1, out=idx) # right edge goes in the last bin
+
+        self.counts += np.bincount(idx, minlength=self.nbins)
+        nlow = np.count_nonzero(v < lo)
+        self.underflow += nlow
+        self.overflow += len(v) - len(v_in) - nlow
+        self.n += len(v_in)
+        self.sum += v_in.sum()
+        self.sumsq += np.dot(v_in, v_in)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the counts of another Histogram with identical bins to this one.
+        """
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('Cannot merge histograms with different bins')
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        self.n += other.n
+        self.sum += other.sum
+        self.sumsq += other.sumsq
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def centers(self):
+        """
+        Returns bin centers.
+        """
+        return 0.5*(self.edges[1:] + self.edges[:-1])
+
+    def density(self):
+        """
+        Returns the counts normalized to a probability density over the binned range
+        (all nan if nothing has been binned).
+        """
+        if self.n == 0:
+            return np.full(self.nbins, np.nan)
+        return self.counts/(self.n*np.diff(self.edges))
+
+    def mean(self):
+        """
+        Returns the mean of the binned samples (nan if there are none).
+        """
+        if self.n == 0:
+            return np.nan
+        return self.sum/self.n
+
+    def std(self):
+        """
+        Returns the standard deviation of the binned samples (nan if there are none).
+        """
+        if self.n == 0:
+            return np.nan
+        return np.sqrt(max(self.sumsq/self.n - self.mean()**2, 0.0))
@@ -1,17 +1,48 @@
 #From Chapter 3
 import numpy as np
-import pandas as pd
-import os
-import matplotlib.pyplot as plt
-from copy import deepcopy
-from scipy.interpolate import UnivariateSpline
-from scipy.ndimage import convolve, gaussian_filter
-from scipy import signal
-from astropy.io import fits
+import os, sys
+import gzip
+import json
+import hashlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # src, for Profiler
+    from Histogram import Histogram
+else:
+    from MyData.Histogram import Histogram
+from Profiler.Profiler import hotpath
 
 class MyData:
+    # kernels with at least this many elements are convolved via FFT rather than directly
+    # (crossover measured on a 1000x1000 float64 image, see benchmarks/smoother_crossover.py)
+    _fft_kernel_size = 81
+
+    # native container format (WriteMyData/ReadMyData):
+    #   magic, uint64 little-endian header length, JSON header, then each array's raw bytes
+    #   starting on an _align byte boundary so it can be memory mapped in place
+    _magic = b'MYDATA\x00\x01'
+    _align = 64
+    _container_arrays = ['x', 'y', 'z', 'array']
+    _container_meta = ['filename', 'ndim', 'nx', 'ny', 'nz', 'nxa', 'nya']
+
+    # parsed workbook sheets, shared by all instances: in memory (most recent _excel_cache_size)
+    # and as one .npz of column arrays under _excel_cache_dir, keyed by file path, mtime, size and sheet
+    _excel_cache = OrderedDict()
+    _excel_cache_size = 8
+    _excel_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'MyData')
+
+    # upper bound on the memory held by each object's cache of products derived from array
+    _product_cache_bytes = 256*2**20
+
+    # elements per block for the missing-data aware reductions; a multiple of 8 so blocks
+    # start on a byte of the validity bitmaps
+    _valid_chunksize = 2**20
+
     def __init__(self,filename='NoFile'):
         self.filename = filename
+        self.valid = {} # attribute name -> packed validity bitmap, see SetValid
         self.ndim = 0 
         self.x = []
         self.nx = 0
@@ -24,6 +55,232 @@ class MyData:
         self.nxa = 0
         self.nya = 0
         
+    @property
+    def x(self):
+        return self._x
+
+    @x.setter
+    def x(self, value):
+        self._x = value
+        self.valid.pop('x', None) # new data starts out all valid
+
+    @property
+    def y(self):
+        return self._y
+
+    @y.setter
+    def y(self, value):
+        self._y = value
+        self.valid.pop('y', None)
+
+    @property
+    def z(self):
+        return self._z
+
+    @z.setter
+    def z(self, value):
+        self._z = value
+        self.valid.pop('z', None)
+
+    @property
+    def array(self):
+        return self._array
+
+    @array.setter
+    def array(self, value):
+        self._array = value
+        self.valid.pop('array', None)
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Marks everything derived from array (smoothed images, pyramids, contours, statistics) stale.
+        Happens automatically when array is assigned; call it after modifying array in place.
+        """
+        self.version = getattr(self, 'version', -1) + 1
+        self._products = OrderedDict() # (version, product key) -> (value, nbytes)
+        self._products_bytes = 0
+
+    def _lookup(self, key):
+        # cached product for the current array version, or None
+        hit = self._products.get((self.version,) + key)
+        if hit is None:
+            return None
+        self._products.move_to_end((self.version,) + key)
+        return hit[0]
+
+    def _store(self, key, value, size=None):
+        # caches value, evicting the least recently used products beyond _product_cache_bytes
+        size = _nbytes(value) if size is None else size
+        if size > MyData._product_cache_bytes:
+            return value
+        self._products[(self.version,) + key] = (value, size)
+        self._products_bytes += size
+        while self._products_bytes > MyData._product_cache_bytes:
+            _, (_, evicted) = self._products.popitem(last=False)
+            self._products_bytes -= evicted
+        return value
+
+    def SetValid(self, which, mask):
+        """
+        Attaches a validity mask to self.<which> (e.g. 'x', 'y' or 'array'); the missing-data aware
+        methods (Mean, Std, Min, Max, ArgMin, ArgMax, HistogramData, Statistics, smoother) then skip
+        the invalid entries. The mask is kept as a bitmap, one bit per element.
+
+        Arguments:
+            which: str, name of the data attribute
+            mask: bool array, same shape as the data, True where valid (e.g. the inverse of a bad-pixel
+                mask); None removes the bitmap
+        """
+        if mask is None:
+            self.valid.pop(which, None)
+        else:
+            mask = np.asarray(mask, dtype=bool)
+            if mask.shape != np.shape(getattr(self, which)):
+                raise ValueError(f'Mask has shape {mask.shape}, {which} has shape {np.shape(getattr(self, which))}')
+            self.valid[which] = np.packbits(mask.ravel(), bitorder='little')
+        if which == 'array':
+            self.invalidate()
+
+    def MarkMissing(self, which, missing=np.nan):
+        """
+        Marks the entries of self.<which> equal to the sentinel missing (and any NaNs) invalid,
+        in addition to entries already marked invalid. The data is scanned in blocks, so
+        memory-mapped arrays are never loaded whole.
+        """
+        data = np.asarray(getattr(self, which)).reshape(-1)
+        bits = np.empty((len(data)+7)//8, dtype=np.uint8)
+        n = MyData._valid_chunksize
+        for start in range(0, len(data), n):
+            block = data[start:start+n]
+            bad = np.isnan(block) if np.issubdtype(block.dtype, np.floating) else np.zeros(len(block), dtype=bool)
+            if not np.isnan(missing):
+                bad |= block == missing
+            bits[start//8:(start+len(block)+7)//8] = np.packbits(~bad, bitorder='little')
+        old = self.valid.get(which)
+        self.valid[which] = bits if old is None else bits & old
+        if which == 'array':
+            self.invalidate()
+
+    def Valid(self, which, rows=None):
+        """
+        Returns the validity mask of self.<which> as a bool array, or None if all of it is valid.
+
+        Arguments:
+            rows: slice of the first axis; only the mask of those rows is unpacked
+        """
+        bits = self.valid.get(which)
+        if bits is None:
+            return None
+        shape = np.shape(getattr(self, which))
+        if len(bits) != (int(np.prod(shape))+7)//8:
+            raise ValueError(f'Validity bitmap does not match {which}; reset it with SetValid')
+        if rows is None:
+            return np.unpackbits(bits, count=int(np.prod(shape)), bitorder='little').view(bool).reshape(shape)
+        r0, r1, _ = rows.indices(shape[0])
+        rowsize = int(np.prod(shape[1:]))
+        first, last = r0*rowsize, max(r1, r0)*rowsize
+        block = np.unpackbits(bits[first//8:(last+7)//8], bitorder='little')[first % 8:first % 8 + last - first]
+        return block.view(bool).reshape((max(r1-r0, 0),) + tuple(shape[1:]))
+
+    def _valid_blocks(self, which, chunksize=None):
+        # yields (offset, flat block of self.<which>, its validity mask or None), chunksize
+        # (rounded up to a multiple of 8; default _valid_chunksize) elements at a time
+        data = np.asarray(getattr(self, which)).reshape(-1)
+        bits = self.valid.get(which)
+        if bits is not None and len(bits) != (len(data)+7)//8:
+            raise ValueError(f'Validity bitmap does not match {which}; reset it with SetValid')
+        n = MyData._valid_chunksize if chunksize is None else -(-int(chunksize)//8)*8
+        for start in range(0, len(data), n):
+            block = data[start:start+n]
+            mask = None
+            if bits is not None:
+                mask = np.unpackbits(bits[start//8:(start+n)//8], count=len(block), bitorder='little').view(bool)
+            yield start, block, mask
+
+    def _moments(self, which):
+        # (count, mean, sum of squared deviations) of the valid entries, merged block by block
+        n, mean, m2 = 0, 0.0, 0.0
+        for start, block, mask in self._valid_blocks(which):
+            if mask is not None:
+                block = block[mask]
+            nb = len(block)
+            if nb == 0:
+                continue
+            meanb = block.mean(dtype=np.float64)
+            dev = block - meanb
+            m2b = np.dot(dev, dev)
+            delta = meanb - mean
+            mean = mean + delta*(nb/(n+nb))
+            m2 = m2 + m2b + delta**2*(n*nb/(n+nb))
+            n += nb
+        return n, mean, m2
+
+    def Mean(self, which='x'):
+        """
+        Returns the mean of the valid entries of self.<which> (nan if there are none).
+        """
+        n, mean, m2 = self._moments(which)
+        return mean if n else np.nan
+
+    def Std(self, which='x', ddof=0):
+        """
+        Returns the standard deviation of the valid entries of self.<which>.
+        """
+        n, mean, m2 = self._moments(which)
+        return np.sqrt(m2/(n-ddof)) if n > ddof else np.nan
+
+    def _extreme(self, which, op):
+        # (value, flat index) of the smallest (op 'min') or largest ('max') valid entry
+        best, best_idx = None, -1
+        for start, block, mask in self._valid_blocks(which):
+            if mask is not None:
+                if not mask.any():
+                    continue
+                if np.issubdtype(block.dtype, np.integer):
+                    info = np.iinfo(block.dtype)
+                    fill = info.max if op == 'min' else info.min
+                else:
+                    fill = np.inf if op == 'min' else -np.inf
+                block = np.where(mask, block, fill)
+            i = block.argmin() if op == 'min' else block.argmax()
+            #ties (including a valid entry equal to the fill) go to the first valid one
+            if mask is not None and not mask[i]:
+                i = np.flatnonzero(mask & (block == block[i]))[0]
+            if best is None or (block[i] < best if op == 'min' else block[i] > best):
+                best, best_idx = block[i], start + i
+        if best is None:
+            raise ValueError(f'{which} has no valid entries')
+        return best, best_idx
+
+    def Min(self, which='x'):
+        """
+        Returns the smallest valid entry of self.<which>.
+        """
+        return self._extreme(which, 'min')[0]
+
+    def Max(self, which='x'):
+        """
+        Returns the largest valid entry of self.<which>.
+        """
+        return self._extreme(which, 'max')[0]
+
+    def ArgMin(self, which='x'):
+        """
+        Returns the index (a tuple for multi-dimensional data) of the smallest valid entry of self.<which>.
+        """
+        idx = self._extreme(which, 'min')[1]
+        shape = np.shape(getattr(self, which))
+        return idx if len(shape) == 1 else np.unravel_index(idx, shape)
+
+    def ArgMax(self, which='x'):
+        """
+        Returns the index (a tuple for multi-dimensional data) of the largest valid entry of self.<which>.
+        """
+        idx = self._extreme(which, 'max')[1]
+        shape = np.shape(getattr(self, which))
+        return idx if len(shape) == 1 else np.unravel_index(idx, shape)
+
     def xline(self,xmin,xmax,nx):
         self.nx = nx
         self.ndim = 1
@@ -37,12 +294,14 @@ class MyData:
             print("x value not one dimensional")
 
     def plotxy(self):
+        import matplotlib.pyplot as plt
         plt.cla()
         plt.title(self.filename)
         plt.plot(self.x,self.y)
         plt.show()
 
     def plotpoints(self, **kwargs):
+        import matplotlib.pyplot as plt
 
         title = kwargs.pop('title', self.filename)
         ax = kwargs.pop('ax', None)
@@ -56,19 +315,106 @@ class MyData:
         ax.set_title(title)
 
 
-    def GetFits(self, filename):
+    @hotpath('read')
+    def GetFits(self, filename, ext=0, section=None, header_only=False, memmap=True):
+        """
+        Reads an image HDU of a FITS file into self.array and its header into self.header.
+        The file is closed before returning.
+
+        Arguments:
+            filename: str, FITS file to read
+            ext: int or str, index or EXTNAME of the HDU to read; default: primary HDU
+            section: tuple of slices, e.g. (slice(100,200), slice(0,50)); if given only
+                that cutout is read from disk
+            header_only: bool, if True only the header is read; self.array and its sizes
+                (nxa, nya, ndim) are left alone
+            memmap: bool, memory map the file; without a section the full array is then
+                paged in only as it is touched. Scaled images (BZERO/BSCALE/BLANK keywords, e.g.
+                unsigned 16-bit frames) cannot be mapped and are read into memory instead
+        """
+        from astropy.io import fits
         self.filename = filename
-        hdul = fits.open(filename)
-        self.array = fits.getdata(filename)
-        self.header = hdul[0].header
-        sh = np.shape(self.array)
-        self.nxa = sh[0]
-        self.nya = sh[1]
-        self.ndim = 2
-            
-    def GetTableData(self, filename):
+        with fits.open(filename, memmap=memmap) as hdul:
+            hdu = hdul[ext]
+            self.header = hdu.header
+            if header_only:
+                return
+            if not (memmap and any(k in hdu.header for k in ('BZERO', 'BSCALE', 'BLANK'))):
+                self.array = hdu.data if section is None else hdu.section[section]
+                sh = np.shape(self.array)
+            else:
+                sh = None
+        if sh is None:
+            #scaled image: astropy only applies the scaling to data read without memmap
+            with fits.open(filename, memmap=False) as hdul:
+                hdu = hdul[ext]
+                self.array = hdu.data if section is None else hdu.section[section]
+            sh = np.shape(self.array)
+        if len(sh) >= 2:
+            self.nxa = sh[0]
+            self.nya = sh[1]
+            self.ndim = 2
+
+    def _table_reader(self, filename, columns=None, header=False, chunksize=None, missing=None):
+        """
+        Returns a pandas reader over a whitespace-delimited text table ('#' starts a comment).
+        Yields DataFrames of chunksize rows if chunksize is given, otherwise one DataFrame.
+
+        Arguments:
+            columns: list of int (column index) or str (column name, needs header) to keep,
+                in the order they are wanted; default: all columns
+            header: bool, True if the first non-comment line holds column names
+            missing: value or list of values (e.g. -99 or 'DQ') read as NaN
+        """
+        import pandas as pd
+        na_values = None if missing is None else list(np.atleast_1d(missing).astype(str))
+        return pd.read_csv(filename, sep=r'\s+', comment='#', header=0 if header else None,
+                           usecols=columns, dtype=np.float64, chunksize=chunksize, na_values=na_values)
+
+    def _table_block(self, df, columns):
+        # usecols keeps file order; put the columns in the requested order
+        if columns is None:
+            return df.to_numpy()
+        if all(isinstance(c, (int, np.integer)) for c in columns):
+            order = [sorted(columns).index(c) for c in columns]
+            return df.to_numpy()[:, order]
+        return df[list(columns)].to_numpy()
+
+    def IterTableData(self, filename, chunksize=100000, columns=None, header=False):
+        """
+        Iterates over a text table in blocks of at most chunksize rows.
+        Yields array(nrows, ncols) float; see _table_reader for columns and header.
+        """
+        with self._table_reader(filename, columns, header, chunksize) as reader:
+            for df in reader:
+                yield self._table_block(df, columns)
+
+    def ReadTableInto(self, out, filename, columns=None, header=False, chunksize=100000):
+        """
+        Reads a text table into the preallocated array out, chunksize rows at a time.
+        out is array(nrows, ncols), or array(nrows,) for a single column.
+        Returns the number of rows read.
+        """
+        nrow = 0
+        for block in self.IterTableData(filename, chunksize, columns, header):
+            n = len(block)
+            if nrow + n > len(out):
+                raise ValueError(f'{filename} has more than {len(out)} rows')
+            out[nrow:nrow+n] = block.reshape((n,) + out.shape[1:])
+            nrow += n
+        return nrow
+
+    @hotpath('read')
+    def GetTableData(self, filename, columns=None, header=False, missing=None):
+        """
+        Reads a text table; the first (selected) column goes to self.x, the second to self.y.
+        See _table_reader for columns and header. If missing is given, the entries equal to it
+        are read as NaN and marked invalid in self.valid.
+        """
         self.filename = filename
-        data_array=np.genfromtxt(filename)
+        data_array = self._table_block(self._table_reader(filename, columns, header, missing=missing), columns)
+        if data_array.shape[1] == 1:
+            data_array = data_array[:, 0]
         s = data_array.shape
         if len(s) == 1 :
             self.x= data_array
@@ -78,18 +424,51 @@ class MyData:
             self.y = data_array[:, 1]
             self.nx = s[0]
             self.ny = s[0] #one y value for each x value
+        if missing is not None:
+            for which in ['x', 'y'][:1 if len(s) == 1 else 2]:
+                self.MarkMissing(which)
 
-    def WriteTableData(self,filename='test.txt'):
-        f = open(filename,"w")
-        if self.ny == 0:
-            for i in range(0,self.nx):
-                f.write('%8.4f\n' % self.x[i] )
+    @hotpath('write')
+    def WriteTableData(self,filename='test.txt', fmt='%8.4f', sep='  ', which=None, data=None,
+                       chunksize=100000, compress=None):
+        """
+        Writes a text table, one row per line, formatting chunksize rows at a time.
+
+        Arguments:
+            filename: str, output file
+            fmt: str, %-format applied to every value
+            sep: str, separator between columns
+            which: str, name of an attribute (e.g. 'array') to write instead of self.x (and self.y)
+            data: array(n,) or array(n, ncol) to write, or an iterable of such blocks
+                (e.g. IterTableData) for tables larger than memory
+            compress: bool, gzip the output; default: True if filename ends in '.gz'
+        Default output (self.x, or self.x and self.y if ny is set) is '%8.4f' columns separated by two blanks.
+        """
+        if data is None:
+            if which is not None:
+                data = np.asarray(getattr(self, which))
+            elif self.ny == 0:
+                data = np.asarray(self.x)[:self.nx]
+            else:
+                data = np.column_stack((self.x[:self.nx], self.y[:self.nx]))
+
+        if isinstance(data, np.ndarray):
+            blocks = (data[i:i+chunksize] for i in range(0, len(data), chunksize))
         else:
-            for i in range(0,self.nx):
-                f.write('%8.4f  %8.4f\n' % (self.x[i],self.y[i]))
-        f.close()
+            blocks = (np.asarray(b) for b in data)
+
+        if compress is None:
+            compress = filename.endswith('.gz')
+        opener = gzip.open if compress else open
+
+        with opener(filename, "wt") as f:
+            for block in blocks:
+                block = block.reshape(len(block), -1)
+                rowfmt = sep.join([fmt]*block.shape[1]) + '\n'
+                f.write((rowfmt*len(block)) % tuple(block.ravel().tolist()))
 
     def Quicklook(self):
+        import matplotlib.pyplot as plt
         if (self.nx == 0):
             print("Whoops! No Data")
             return
@@ -101,87 +480,537 @@ class MyData:
         plt.show()
         print("length of x list is ",len(self.x), "items")
         
-    def ReadInteger16(self,filename,nxa=256,nya=256):
+    def _read_binary(self, filename, dtype, shape=None, byteorder=None, offset=0, mmap=False):
+        """
+        Returns the raw contents of a binary file as an array.
+
+        Arguments:
+            filename: str, file to read
+            dtype: numpy dtype of the stored values
+            shape: tuple, shape of the returned array; default: 1-d, all values after offset
+            byteorder: str {'<', '>', '='}, byte order of the stored values; default: dtype's own
+            offset: int, number of bytes to skip at the start of the file
+            mmap: bool, if True the array is a copy-on-write np.memmap; pages are only read
+                from disk when they are touched, and changes are never written back to the file.
+                The file must then not be truncated or overwritten in place while the array is in use
+                (the Write methods of this class replace files rather than overwrite them)
+        """
+        dt = np.dtype(dtype)
+        if byteorder is not None:
+            dt = dt.newbyteorder(byteorder)
+
+        if mmap and os.path.getsize(filename) > offset: # empty files cannot be mapped
+            return np.memmap(filename, dtype=dt, mode='c', offset=offset, shape=shape)
+
+        count = -1 if shape is None else int(np.prod(shape))
+        data = np.fromfile(filename, dtype=dt, count=count, offset=offset)
+        return data if shape is None else data.reshape(shape)
+
+    @hotpath('read')
+    def ReadInteger16(self,filename,nxa=256,nya=256, dtype='i2', byteorder=None, offset=0, mmap=False, missing=None):
+        """
+        Reads a nxa by nya image of binary integers into self.array.
+        See _read_binary for dtype, byteorder, offset and mmap.
+        If missing is given, pixels equal to it are marked invalid in self.valid.
+        """
         self.filename = filename
-        data = np.fromfile('m33.dat', dtype='i2')
-        self.array = np.reshape(np.array(data),(nxa,nya))
+        self.array = self._read_binary(filename, dtype, shape=(nxa,nya),
+                                       byteorder=byteorder, offset=offset, mmap=mmap)
+        if missing is not None:
+            self.MarkMissing('array', missing)
         self.ndim = 2
         self.nxa = nxa
         self.nya = nya
         
+    @hotpath('write')
     def WriteFloat64(self,filename="test.dat"):
         self.filename = filename
-        f= open(self.filename,"w+")
-        self.x.tofile(f)
-        f.close()
+        with _replacing(self.filename) as f:
+            self.x.tofile(f)
 
-    def ReadFloat64(self,filename="test.dat",nxa=256,nya=256):
+    @hotpath('read')
+    def ReadFloat64(self,filename="test.dat",nxa=256,nya=256, shape=None, dtype='f8', byteorder=None, offset=0, mmap=False,
+                    missing=None):
+        """
+        Reads binary floats into self.y; 1-d unless shape is given.
+        See _read_binary for dtype, byteorder, offset and mmap.
+        If missing is given (a sentinel value, or np.nan), entries equal to it and NaNs are marked invalid in self.valid.
+        """
         self.filename = filename
-        f= open(self.filename,"r")
-        self.y=np.fromfile(f,'f8')
-        f.close()
+        self.y = self._read_binary(filename, dtype, shape=shape,
+                                   byteorder=byteorder, offset=offset, mmap=mmap)
+        if missing is not None:
+            self.MarkMissing('y', missing)
+
+    @hotpath('write')
+    def WriteMyData(self, filename="test.mydata"):
+        """
+        Saves x, y, z, array, their validity bitmaps, header and the size attributes to a
+        self-describing binary file. Read it back with ReadMyData. The file is written under a temporary name and then renamed,
+        so arrays memory-mapped from an earlier version of it (ReadMyData) are written intact.
+        """
+        arrays = dict([(f, np.ascontiguousarray(getattr(self, f))) for f in MyData._container_arrays])
+        arrays.update([(f'valid.{f}', self.valid[f]) for f in MyData._container_arrays if f in self.valid])
+        for f, a in arrays.items():
+            if a.dtype.hasobject:
+                raise ValueError(f'Cannot write {f}: object arrays are not supported')
 
-    def ReadExcelColumn(self, filename, sheetname, columnname):
+        header = self.header.tostring() if hasattr(self.header, 'tostring') else None # astropy Header
+        desc = {'meta': dict([(m, getattr(self, m)) for m in MyData._container_meta]),
+                'header': header,
+                'fields': {}}
+
+        #lay the arrays out after the header; the header length depends on the offsets,
+        #so grow the reserved header size until it fits
+        hlen = 1024
+        while True:
+            offset = len(MyData._magic) + 8 + hlen
+            for f, a in arrays.items():
+                offset = -(-offset // MyData._align)*MyData._align
+                desc['fields'][f] = {'dtype': a.dtype.str, 'shape': a.shape, 'offset': offset}
+                offset += a.nbytes
+            hbytes = json.dumps(desc, default=lambda v: v.item()).encode() # numpy scalars -> python
+            if len(hbytes) <= hlen:
+                break
+            hlen = 2*len(hbytes)
+
+        with _replacing(filename) as f:
+            f.write(MyData._magic)
+            f.write(np.uint64(hlen).astype('<u8').tobytes())
+            f.write(hbytes.ljust(hlen, b' '))
+            for field, a in arrays.items():
+                f.seek(desc['fields'][field]['offset'])
+                f.write(a.data)
+
+    @hotpath('read')
+    def ReadMyData(self, filename="test.mydata", mmap=True):
+        """
+        Restores an object saved with WriteMyData.
+        If mmap, the arrays are copy-on-write np.memmaps into the file and nothing is read until used.
+        """
+        with open(filename, 'rb') as f:
+            magic = f.read(len(MyData._magic))
+            if magic != MyData._magic:
+                raise ValueError(f'{filename} is not a MyData file')
+            hlen = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            desc = json.loads(f.read(hlen))
+
+        for m, v in desc['meta'].items():
+            setattr(self, m, v)
         self.filename = filename
-        e = pd.ExcelFile(filename)
-        ep = e.parse(sheetname)
-        df=ep[columnname]
-        self.x = df.values
+        if desc['header'] is not None:
+            from astropy.io import fits
+            self.header = fits.Header.fromstring(desc['header'])
+        else:
+            self.header = []
+
+        valid = {}
+        for field, d in desc['fields'].items():
+            shape = tuple(d['shape'])
+            if int(np.prod(shape)) == 0:
+                a = np.empty(shape, dtype=d['dtype'])
+            else:
+                a = self._read_binary(filename, d['dtype'], shape=shape, offset=d['offset'], mmap=mmap)
+            if field.startswith('valid.'):
+                valid[field[len('valid.'):]] = np.asarray(a)
+            else:
+                # keep 'empty' fields the way the constructor makes them
+                setattr(self, field, a if a.size or a.ndim > 1 else [])
+        #after the arrays, whose setters drop any bitmap
+        self.valid = valid
+        self.invalidate()
+
+    @hotpath('read')
+    def ReadExcelSheet(self, filename, sheetname, cache=True, cache_dir=None):
+        """
+        Returns a workbook sheet as a DataFrame, parsing the file only if the sheet
+        is not already cached in memory or on disk. Each call returns a new copy.
+
+        Arguments:
+            filename: str, workbook
+            sheetname: str or int, sheet name or index
+            cache: bool, use (and fill) the on-disk cache
+            cache_dir: str, on-disk cache directory; default: MyData._excel_cache_dir
+        """
+        return self._excel_sheet(filename, sheetname, cache, cache_dir).copy()
+
+    def _excel_sheet(self, filename, sheetname, cache=True, cache_dir=None):
+        # the cached DataFrame of a sheet, shared between callers; never modify it
+        import pandas as pd
+        st = os.stat(filename)
+        key = f'{os.path.abspath(filename)}|{st.st_mtime_ns}|{st.st_size}|{sheetname}'
+
+        df = MyData._excel_cache.get(key)
+        if df is not None:
+            MyData._excel_cache.move_to_end(key)
+            return df
+
+        cache_dir = cache_dir if cache_dir is not None else MyData._excel_cache_dir
+        cache_file = os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npz')
+        df = _read_columns(cache_file) if cache and os.path.exists(cache_file) else None
+        if df is None:
+            df = pd.read_excel(filename, sheet_name=sheetname)
+            if cache:
+                os.makedirs(cache_dir, exist_ok=True)
+                _write_columns(cache_file, df)
+
+        MyData._excel_cache[key] = df
+        while len(MyData._excel_cache) > MyData._excel_cache_size:
+            MyData._excel_cache.popitem(last=False)
+        return df
+
+    @hotpath('read')
+    def ReadExcelColumns(self, filename, sheetname, columnnames=None, **kwargs):
+        """
+        Returns a dict of column name: array for columnnames (default: every column) of a sheet.
+        The sheet is parsed at most once; kwargs go to ReadExcelSheet.
+        """
+        self.filename = filename
+        df = self._excel_sheet(filename, sheetname, **kwargs)
+        columnnames = df.columns if columnnames is None else columnnames
+        return dict([(c, df[c].to_numpy(copy=True)) for c in columnnames])
+
+    @hotpath('read')
+    def ReadExcelColumn(self, filename, sheetname, columnname, **kwargs):
+        self.x = self.ReadExcelColumns(filename, sheetname, [columnname], **kwargs)[columnname]
         self.nx = len(self.x)
         self.ndim = 1
         
+    @hotpath('write')
     def WriteExcelColumn(self, filename):
+        import pandas as pd
         df = pd.DataFrame(data=self.x)
         with pd.ExcelWriter(filename) as writer:
             df.to_excel(writer)
-            
-    def MyHistogram(self,bins=10):
-        hi=np.histogram(self.x,bins=bins)
-        hy=np.array(hi[0])
-        hx=np.array(hi[1])
-        hx=hx[1:]
-        plt.cla()
-        #plt.plot(hx,hy,linestyle='steps')
-        plt.plot(hx,hy,linestyle='-')
-        plt.show()
 
+    @hotpath('write')
+    def WriteExcelColumns(self, filename, columns=None, sheetname='Sheet1', index=True):
+        """
+        Writes many columns to a workbook sheet in one pass.
+
+        Arguments:
+            columns: dict of column name: array; default: self.x (and self.y if ny is set)
+            sheetname: str
+            index: bool, write the row index as the first column
+        """
+        import pandas as pd
+        if columns is None:
+            columns = {'x': self.x} if self.ny == 0 else {'x': self.x, 'y': self.y}
+        df = pd.DataFrame(data=columns)
+        with pd.ExcelWriter(filename) as writer:
+            df.to_excel(writer, sheet_name=sheetname, index=index)
+            
     def Slice(self, slc):
         """
-        slices self.x and self.y according to slc
+        slices self.x and self.y (and their validity masks) according to slc
         """
         if self.nx == 0:
             raise ValueError('Data object has no data to slice')
-        self.x = self.x[slc]
+        for which in ['x', 'y'] if self.ny != 0 else ['x']:
+            mask = self.Valid(which)
+            setattr(self, which, getattr(self, which)[slc])
+            if mask is not None:
+                self.SetValid(which, mask[slc])
         self.nx = len(self.x)
         if self.ny != 0:
-            self.y = self.y[slc]
             self.ny = len(self.y)
 
 
     #helper routine for smoothing
-    def smoother(self, smooth_type='gaussian', smooth_param=1.0):
+    @hotpath('compute')
+    def smoother(self, smooth_type='gaussian', smooth_param=1.0, method='auto',
+                 tile=None, workers=1, executor='thread', out=None):
+        """
+        Returns a smoothed copy of self.array.
 
+        Arguments:
+            smooth_type: str {'gaussian', 'convolve'}
+            smooth_param: for 'gaussian', the standard deviation of the gaussian kernel;
+                for 'convolve', either the size n of an n by n box kernel or a 2-d kernel array.
+                Kernels are normalized by their sum (unless it is zero) to retain the original scaling.
+            method: str {'auto', 'box', 'fft', 'direct'}, how to convolve for smooth_type 'convolve':
+                'box': separable running sum, O(1) per pixel; only valid for constant kernels
+                'fft': FFT convolution of the reflect-padded image
+                'direct': scipy.ndimage.convolve
+                'auto': 'box' for constant kernels, else 'fft' for kernels with at least
+                    _fft_kernel_size elements, else 'direct'
+            tile: int or (int, int), if given the image is smoothed tile by tile, each tile read
+                with a halo wide enough for the kernel so the result matches the untiled one
+            workers: int, number of tiles smoothed concurrently
+            executor: str {'thread', 'process'}, pool the tiles are distributed over
+            out: array or str; preallocated output for tiled smoothing, or a filename for a
+                memory-mapped output file. Default: a new in-memory array
+        If array has a validity bitmap (see SetValid), invalid pixels are left out by normalized
+        convolution: the smoothed valid data is divided by the smoothed mask. The result is then
+        floating point, and NaN where the kernel covers no valid pixel.
+        """
         if smooth_type != 'gaussian' and smooth_type != 'convolve':
             raise ValueError(f'Invalid smooth_type: {smooth_type}, valid smooth_types: gaussian and convolve')
+
+        if method not in ('auto', 'box', 'fft', 'direct'):
+            raise ValueError(f'Invalid method: {method}, valid methods: auto, box, fft and direct')
+
+        if tile is not None:
+            return self._tiled_smoother(smooth_type, smooth_param, method, tile, workers, executor, out)
         
+        mask = self.Valid('array')
+        if mask is not None:
+            #normalized convolution: smooth the zero-filled data and the mask alike, then divide
+            dtype = self.array.dtype if np.issubdtype(self.array.dtype, np.floating) else np.float64
+            weight = self._smooth(mask.astype(dtype), smooth_type, smooth_param, method)
+            smoothed = self._smooth(np.where(mask, self.array, 0).astype(dtype), smooth_type, smooth_param, method)
+            empty = weight <= 1e-12
+            weight[empty] = 1.0
+            smoothed /= weight
+            smoothed[empty] = np.nan
+            return smoothed
+
         #prevent overflows
-        if self.array.dtype == np.int16:
+        if np.issubdtype(self.array.dtype, np.int16):
             data = self.array.astype(np.int32)
         else:
             data = self.array
 
+        return self._smooth(data, smooth_type, smooth_param, method)
+
+    def _smooth(self, data, smooth_type, smooth_param, method):
+        # smooths data by smooth_type; see smoother
+        from scipy.ndimage import gaussian_filter
+
         if smooth_type == 'gaussian':
             smoothed = gaussian_filter(data, smooth_param)
         elif smooth_type == 'convolve':
-            filter = np.ones((smooth_param, smooth_param))
-            smoothed = convolve(data, filter)/filter.sum() # retain orig scaling
+            smoothed = self._convolve(data, smooth_param, method)
         else:
             assert False # shouldn't get here
 
         return smoothed
+
+    def _tiled_smoother(self, smooth_type, smooth_param, method, tile, workers, executor, out):
+        """
+        Tiled, optionally parallel version of smoother; see smoother for the arguments.
+        """
+        if executor not in ('thread', 'process'):
+            raise ValueError(f'Invalid executor: {executor}, must be either \'thread\' or \'process\'')
+
+        shape = self.array.shape
+        tile = (tile,)*len(shape) if np.ndim(tile) == 0 else tuple(tile)
+
+        #halo: how far outside a tile the kernel reaches
+        if smooth_type == 'gaussian':
+            truncate = 4.0 # gaussian_filter default
+            halo = [int(truncate*float(sig) + 0.5) for sig in np.broadcast_to(smooth_param, (len(shape),))]
+            in_dtype = np.int32 if np.issubdtype(self.array.dtype, np.int16) else self.array.dtype
+            out_dtype = in_dtype
+        else:
+            kshape = (int(smooth_param),)*len(shape) if np.ndim(smooth_param) == 0 else np.shape(smooth_param)
+            halo = list(kshape)
+            out_dtype = self.array.dtype if np.issubdtype(self.array.dtype, np.floating) else np.float64
+        masked = 'array' in self.valid
+        if masked and not np.issubdtype(out_dtype, np.floating):
+            out_dtype = np.float64 # normalized convolution
+
+        if out is None:
+            out = np.empty(shape, dtype=out_dtype)
+        elif isinstance(out, str):
+            out = np.memmap(out, dtype=out_dtype, mode='w+', shape=shape)
+        elif out.shape != shape:
+            raise ValueError(f'out has shape {out.shape}, expected {shape}')
+
+        def tiles():
+            for start in np.ndindex(*[(n + t - 1)//t for n, t in zip(shape, tile)]):
+                core = tuple(slice(i*t, min((i+1)*t, n)) for i, t, n in zip(start, tile, shape))
+                padded = tuple(slice(max(c.start-h, 0), min(c.stop+h, n)) for c, h, n in zip(core, halo, shape))
+                inner = tuple(slice(c.start-p.start, c.stop-p.start) for c, p in zip(core, padded))
+                yield core, padded, inner
+
+        def valid(padded):
+            # validity mask of a tile: unpack its rows only, then cut out its columns
+            return self.Valid('array', rows=padded[0])[(slice(None),) + padded[1:]] if masked else None
+
+        if workers <= 1:
+            for core, padded, inner in tiles():
+                out[core] = _smooth_tile(self.array[padded], smooth_type, smooth_param, method, valid(padded))[inner]
+            return out
+
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        pool = ThreadPoolExecutor if executor == 'thread' else ProcessPoolExecutor
+        with pool(max_workers=workers) as ex:
+            #keep at most 2*workers tiles in flight to bound memory
+            pending = []
+            for core, padded, inner in tiles():
+                fut = ex.submit(_smooth_tile, np.asarray(self.array[padded]), smooth_type, smooth_param, method,
+                                valid(padded))
+                pending.append((core, inner, fut))
+                if len(pending) >= 2*workers:
+                    core, inner, fut = pending.pop(0)
+                    out[core] = fut.result()[inner]
+            for core, inner, fut in pending:
+                out[core] = fut.result()[inner]
+
+        return out
+
+    def _convolve(self, data, kernel, method='auto'):
+        """
+        Convolves data with kernel (box size or 2-d array), reflecting at the edges like
+        scipy.ndimage.convolve, and normalizes by the kernel sum.
+        """
+        if np.ndim(kernel) == 0:
+            kernel = np.ones((int(kernel), int(kernel)))
+        kernel = np.asarray(kernel, dtype=float)
+        if kernel.ndim != data.ndim:
+            raise ValueError(f'Kernel has {kernel.ndim} dimensions, data has {data.ndim}')
+
+        norm = kernel.sum()
+        if norm == 0:
+            norm = 1.0 # e.g. derivative kernels; nothing to retain
+        is_box = np.all(kernel == kernel.flat[0])
+
+        if method == 'auto':
+            if is_box:
+                method = 'box'
+            elif kernel.size >= self._fft_kernel_size:
+                method = 'fft'
+            else:
+                method = 'direct'
+
+        out_dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64
+
+        if method == 'box':
+            if not is_box:
+                raise ValueError('method \'box\' requires a constant kernel')
+            #even-sized kernels are centred one pixel later by ndimage.convolve
+            from scipy.ndimage import uniform_filter
+            origin = [0 if n % 2 else -1 for n in kernel.shape]
+            smoothed = uniform_filter(data, kernel.shape, origin=origin, output=out_dtype)
+            smoothed *= kernel.flat[0]*kernel.size/norm
+        elif method == 'fft':
+            from scipy import signal
+            pad = [(n-1-n//2, n//2) for n in kernel.shape]
+            padded = np.pad(data.astype(out_dtype, copy=False), pad, mode='symmetric')
+            smoothed = signal.fftconvolve(padded, kernel, mode='valid')/norm
+        else:
+            from scipy.ndimage import convolve
+            smoothed = convolve(data.astype(out_dtype, copy=False), kernel)/norm
+
+        return smoothed
             
 
+    def Smoothed(self, smooth_type='gaussian', smooth_param=1.0, method='auto'):
+        """
+        Same as smoother, but the result is cached (read-only) until array changes.
+        """
+        key = ('smoothed', smooth_type, _param_key(smooth_param), method)
+        smoothed = self._lookup(key)
+        if smoothed is None:
+            smoothed = self.smoother(smooth_type, smooth_param, method)
+            smoothed.flags.writeable = False
+            self._store(key, smoothed)
+        return smoothed
+
+    def Statistics(self, percentiles=(1, 50, 99)):
+        """
+        Returns dict of min, max, mean and the given percentiles of array, cached until array changes.
+        Invalid pixels (see SetValid) are left out.
+        """
+        key = ('statistics', tuple(percentiles))
+        stats = self._lookup(key)
+        if stats is None:
+            data = np.asarray(self.array)
+            stats = {'min': self.Min('array'), 'max': self.Max('array'), 'mean': self.Mean('array')}
+            mask = self.Valid('array')
+            if mask is not None:
+                data = data[mask]
+            for q, v in zip(percentiles, np.percentile(data, percentiles)):
+                stats[f'p{q}'] = v
+            self._store(key, stats)
+        return stats
+
+    def ImagePyramid(self, method='mean', smooth_type=None, smooth_param=None, min_size=64):
+        """
+        Returns a list of images, level k being self.array (or its Smoothed version) downsampled
+        by 2**k in each axis by combining blocks with method {'mean', 'max'}. Levels stop once the
+        image is no larger than min_size. The pyramid is cached until array changes.
+        """
+        if method not in ('mean', 'max'):
+            raise ValueError(f'Invalid method: {method}, must be either \'mean\' or \'max\'')
+
+        key = ('pyramid', method, smooth_type, _param_key(smooth_param), min_size)
+        pyr = self._lookup(key)
+        if pyr is not None:
+            return pyr
+
+        pyr = [self.array if smooth_type is None else self.Smoothed(smooth_type, smooth_param)]
+        while max(pyr[-1].shape) > min_size:
+            pyr.append(_block_reduce(pyr[-1], method))
+        #level 0 is array itself or cached separately; charge only the reduced levels
+        self._store(key, pyr, size=_nbytes(pyr[1:]))
+        return pyr
+
+    def _pyramid_level(self, ax, pyr, width, height):
+        # coarsest level that still has a data pixel for every screen pixel across width x height data pixels
+        bbox = ax.get_window_extent()
+        f = max(1.0, min(width/max(bbox.width, 1.0), height/max(bbox.height, 1.0)))
+        return min(int(np.log2(f)), len(pyr)-1)
+
+    def _show_pyramid(self, ax, pyr, cmap, on_view=None):
+        """
+        Draws the pyramid level matching the axes size and switches to finer levels
+        (cropped to the view) when the axes are zoomed. Returns the AxesImage.
+        If given, on_view(k, data, extent) is called whenever the level or crop on screen changes.
+        """
+        ny, nx = pyr[0].shape
+        k = self._pyramid_level(ax, pyr, nx, ny)
+        f = 2**k
+        ly, lx = pyr[k].shape
+        pcb = ax.imshow(pyr[k], origin='lower', cmap=cmap, extent=(-0.5, lx*f-0.5, -0.5, ly*f-0.5))
+        ax.set_xlim(-0.5, nx-0.5); ax.set_ylim(-0.5, ny-0.5)
+
+        updating = [False]
+        view = [(k, 0, ly, 0, lx)]
+        def refine(ax):
+            if updating[0]:
+                return
+            x0, x1 = sorted(ax.get_xlim()); y0, y1 = sorted(ax.get_ylim())
+            k = self._pyramid_level(ax, pyr, x1-x0, y1-y0)
+            f = 2**k
+            level = pyr[k]
+            #visible blocks plus a one block margin
+            c0 = max(int((x0+0.5)//f) - 1, 0); c1 = min(int((x1+0.5)//f) + 2, level.shape[1])
+            r0 = max(int((y0+0.5)//f) - 1, 0); r1 = min(int((y1+0.5)//f) + 2, level.shape[0])
+            if (k, r0, r1, c0, c1) == view[0]:
+                return
+            view[0] = (k, r0, r1, c0, c1)
+            updating[0] = True
+            data = level[r0:r1, c0:c1]
+            extent = (c0*f-0.5, c1*f-0.5, r0*f-0.5, r1*f-0.5)
+            pcb.set_data(data)
+            pcb.set_extent(extent)
+            if on_view is not None:
+                on_view(k, data, extent)
+            updating[0] = False
+
+        ax.callbacks.connect('xlim_changed', refine)
+        ax.callbacks.connect('ylim_changed', refine)
+        return pcb
+
+    def _contour(self, ax, data, extent, levels, key):
+        """
+        Draws contours of data on ax; the contour lines are computed once per array version
+        and redrawn from the cache afterwards. Returns the ContourSet.
+        """
+        from matplotlib.contour import ContourSet
+        key = key + (extent, _param_key(levels))
+        cached = self._lookup(key)
+        if cached is None:
+            cs = ax.contour(data, origin='lower', extent=extent, levels=levels, cmap='Reds')
+            self._store(key, (cs.levels, cs.allsegs))
+        else:
+            cs = ContourSet(ax, cached[0], cached[1], cmap='Reds')
+        return cs
+
     def MyImage(self,**kwargs):
+        import matplotlib.pyplot as plt
         ax = kwargs.pop('ax', None)
         cmap = kwargs.pop('cmap', 'gray')
         title = kwargs.pop('title', self.filename)
@@ -191,20 +1020,38 @@ class MyData:
         smooth_param = kwargs.pop('smooth_param', None)
         contours = kwargs.pop('contour_lines', False)
         levels = kwargs.pop('levels', None)
+        pyramid = kwargs.pop('pyramid', 'mean') # ImagePyramid method; None always draws full resolution
 
         fig = None
         if ax is None:
             fig, ax = plt.subplots()
 
-        if smooth_type is None:
-            data = self.array
+        key = ('contour', smooth_type, _param_key(smooth_param), pyramid)
+        if pyramid is None or np.ndim(self.array) != 2:
+            if smooth_type is None:
+                data = self.array
+            else:
+                data = self.Smoothed(smooth_type, smooth_param)
+            pcb = ax.imshow(data, origin='lower',  cmap=cmap)
+            extent = None
         else:
-            data = self.smoother(smooth_type, smooth_param)
-        
-        pcb = ax.imshow(data, origin='lower',  cmap=cmap)
+            pyr = self.ImagePyramid(pyramid, smooth_type, smooth_param)
+            on_view = None
+            if contours:
+                drawn = []
+                def on_view(k, data, extent):
+                    #recontour the level and crop now on screen, at the levels first drawn
+                    drawn[0].remove()
+                    drawn[0] = self._contour(ax, data, extent, drawn[0].levels, key + (k, data.shape))
+            pcb = self._show_pyramid(ax, pyr, cmap, on_view)
+            #contour the level on screen rather than the full-resolution image
+            data = pcb.get_array()
+            extent = tuple(pcb.get_extent())
 
         if contours:
-            pcb = ax.contour(data, origin='lower', levels=levels, cmap='Reds')
+            pcb = self._contour(ax, data, extent, levels, key + (data.shape,))
+            if pyramid is not None and np.ndim(self.array) == 2:
+                drawn.append(pcb)
 
 
         ax.set_title(title)
@@ -220,21 +1067,27 @@ class MyData:
         return pcb
 
     def MyHistogram(self,**kwargs):
+        import matplotlib.pyplot as plt
         ax = kwargs.pop('ax', None)
         xlim = kwargs.pop('xlim', (None, None))
         title = kwargs.pop('title', self.filename)
         density = kwargs.pop('density', False)
         grid = kwargs.pop('grid', True)
         which = kwargs.pop('which','x')
-
-        data = getattr(self, which)
-
+        hist = kwargs.pop('hist', None) # a filled Histogram to draw instead of the data
 
         fig = None
         if ax is None:
             fig, ax = plt.subplots()
 
-        ax.hist(data, density=density, **kwargs)
+        if hist is None:
+            data = getattr(self, which)
+            mask = self.Valid(which)
+            if mask is not None:
+                data = np.asarray(data)[mask]
+            ax.hist(data, density=density, **kwargs)
+        else:
+            ax.hist(hist.edges[:-1], bins=hist.edges, weights=hist.counts, density=density, **kwargs)
         
         ylab = ('Density' if density else 'Count') + f' of {which}'
         ax.set_ylabel(ylab)
@@ -244,20 +1097,229 @@ class MyData:
             ax.grid(axis='y')
 
 
-    def SimData(self, npt=100, rand = 'Uniform',xbar=0.,sigma=1. ):
-        if rand == 'Poisson':
-            #xbar a vector or scalar of poisson expected values
-            l = len(xbar) if hasattr(xbar, '__len__') else 1
-            self.y = np.random.poisson(xbar, l)
-        elif rand == 'Gauss':
-            self.y = np.random.normal(size=npt,loc=xbar,scale=sigma)
-        elif rand == 'Uniform':
-            self.y = np.random.uniform(size=npt)
-        else:
+    def HistogramData(self, which='x', bins=10, range=None, hist=None, chunksize=1000000):
+        """
+        Accumulates the valid entries of self.<which> into a Histogram, a block at a time, and returns it.
+
+        Arguments:
+            bins, range: see Histogram; range defaults to the data's min and max, or (0, 1) if
+                there is no valid data (as np.histogram does)
+            hist: Histogram to add to (e.g. one shared across data sets); default: a new one
+            chunksize: int, number of entries added at a time
+        """
+        if hist is None:
+            if range is None and np.ndim(bins) == 0:
+                try:
+                    range = (self.Min(which), self.Max(which))
+                except ValueError: # no valid entries
+                    range = (0., 1.)
+            hist = Histogram(bins, range)
+        for start, block, mask in self._valid_blocks(which, chunksize):
+            hist.add(block if mask is None else block[mask])
+        return hist
+
+    def SimData(self, npt=100, rand = 'Uniform',xbar=0.,sigma=1., ntrials=None, reduce=None,
+                seed=None, workers=1, chunksize=None):
+        """
+        Simulates random data into self.y.
+
+        Arguments:
+            npt: int, number of points per trial (for Poisson with a vector xbar: len(xbar))
+            rand: str {'Poisson', 'Gauss', 'Uniform'}
+            xbar: float or array, Poisson expected value(s) or Gauss mean
+            sigma: float, Gauss standard deviation
+            ntrials: int; if given, ntrials independent sets of npt points are drawn and self.y is
+                array(ntrials, npt), or its reduction over trials
+            reduce: str {'sum', 'mean', 'var'}, reduce over trials as they are generated,
+                so only chunksize trials are ever in memory; self.y is then array(npt,)
+            seed: int or np.random.SeedSequence; without ntrials, seeds a single Generator,
+                with ntrials, each block of chunksize trials gets its own SeedSequence-spawned
+                Generator, so results are bit-identical for a given seed whatever the number of workers
+            workers: int, number of processes the trial blocks are spread over
+            chunksize: int, trials per block; default: about 2**20 samples per block
+        Without ntrials and seed, samples come from the global numpy.random state as before.
+        """
+        if rand not in ('Poisson', 'Gauss', 'Uniform'):
             raise ValueError(f'Invalid rand: {rand}, must be one of Poisson, Gauss or Uniform')
+        if reduce not in (None, 'sum', 'mean', 'var'):
+            raise ValueError(f'Invalid reduce: {reduce}, must be one of sum, mean or var')
+
+        if rand == 'Poisson' and hasattr(xbar, '__len__'):
+            #xbar a vector of poisson expected values, one per point
+            npt = len(xbar)
+
+        if ntrials is None:
+            rng = np.random.default_rng(seed) if seed is not None else np.random
+            self.y = _draw(rng, rand, (npt,), xbar, sigma)
+            return
+
+        if chunksize is None:
+            chunksize = max(1, 2**20//npt)
+        starts = range(0, ntrials, chunksize)
+        seeds = (seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)).spawn(len(starts))
+        tasks = [(s, rand, min(chunksize, ntrials-start), npt, xbar, sigma, reduce) for s, start in zip(seeds, starts)]
+
+        if workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                blocks = list(ex.map(_sim_block, *zip(*tasks)))
+        else:
+            blocks = [_sim_block(*t) for t in tasks]
+
+        #combine in block order so the result does not depend on workers
+        if reduce is None:
+            self.y = np.concatenate(blocks)
+        elif reduce == 'sum':
+            total = blocks[0]
+            for b in blocks[1:]:
+                total += b
+            self.y = total
+        else:
+            n, mean, m2 = blocks[0]
+            for nb, meanb, m2b in blocks[1:]:
+                #parallel (Chan et al.) update of the mean and sum of squared deviations
+                delta = meanb - mean
+                mean = mean + delta*(nb/(n+nb))
+                m2 = m2 + m2b + delta**2*(n*nb/(n+nb))
+                n += nb
+            self.y = mean if reduce == 'mean' else m2/n
+
+def _write_columns(filename, df):
+    """
+    Saves the columns of a DataFrame as arrays in an .npz file, for _read_columns. Object columns
+    are stored as strings plus a missing-value mask; sheets with columns that cannot be stored
+    that way (e.g. mixed numbers and text) are not written.
+    """
+    import pandas as pd
+    arrays = {}
+    for i, c in enumerate(df.columns):
+        col = df[c]
+        if col.dtype.kind in 'biufcmM':
+            arrays[f'c{i}'] = col.to_numpy()
+            continue
+        values = col.to_numpy(dtype=object)
+        na = np.asarray(pd.isna(col))
+        if not all(isinstance(v, str) for v in values[~na]):
+            return
+        arrays[f'c{i}'] = np.where(na, '', values).astype(str)
+        arrays[f'na{i}'] = na
+    try:
+        arrays['columns'] = np.array(json.dumps(list(df.columns)))
+    except TypeError:
+        return # column names JSON cannot hold
+    with _replacing(filename) as f: # atomic, for concurrent jobs
+        np.savez(f, **arrays)
+
+def _read_columns(filename):
+    """
+    Returns the DataFrame saved by _write_columns, or None if the file cannot be read.
+    Only plain arrays are loaded (no pickles), so the cache cannot run code.
+    """
+    import pandas as pd
+    try:
+        with np.load(filename, allow_pickle=False) as z:
+            columns = json.loads(str(z['columns']))
+            cols = {}
+            for i, c in enumerate(columns):
+                a = z[f'c{i}']
+                if f'na{i}' in z.files:
+                    a = a.astype(object)
+                    a[z[f'na{i}']] = np.nan
+                cols[i] = a
+    except (OSError, ValueError, KeyError):
+        return None
+    df = pd.DataFrame(cols)
+    df.columns = columns
+    return df
+
+@contextmanager
+def _replacing(filename, mode='wb'):
+    """
+    Opens a temporary file next to filename for writing and renames it over filename once
+    written, so data memory-mapped from the old file stays intact and a failed write leaves
+    the old file in place.
+    """
+    tmp = f'{filename}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, mode) as f:
+            yield f
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def _param_key(p):
+    # hashable stand-in for a smoothing parameter, kernel or level list
+    if isinstance(p, np.ndarray):
+        return (p.shape, p.dtype.str, hashlib.blake2b(np.ascontiguousarray(p).tobytes(), digest_size=16).digest())
+    if isinstance(p, list):
+        return tuple(p)
+    return p
+
+def _nbytes(value):
+    # memory held by the arrays in value, recursing into lists, tuples and dicts
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+def _block_reduce(a, method='mean', chunk_rows=1024):
+    """
+    Returns 2-d array a downsampled by 2 in each axis, combining 2x2 blocks by mean or max.
+    Odd edges are padded by repeating the last row/column. a is read chunk_rows output rows
+    at a time, so memory-mapped images are never loaded whole.
+    """
+    ny, nx = a.shape
+    out_ny, out_nx = (ny+1)//2, (nx+1)//2
+    out = np.empty((out_ny, out_nx), dtype=np.float64 if method == 'mean' else a.dtype)
+    for r in range(0, out_ny, chunk_rows):
+        blk = np.asarray(a[2*r:2*(r+chunk_rows)])
+        if blk.shape[0] % 2:
+            blk = np.concatenate([blk, blk[-1:]], axis=0)
+        if nx % 2:
+            blk = np.concatenate([blk, blk[:, -1:]], axis=1)
+        blk = blk.reshape(blk.shape[0]//2, 2, out_nx, 2)
+        out[r:r+chunk_rows] = blk.mean(axis=(1, 3)) if method == 'mean' else blk.max(axis=(1, 3))
+    return out
+
+def _draw(rng, rand, size, xbar, sigma):
+    # samples of the given shape from rng (a Generator or numpy.random)
+    if rand == 'Poisson':
+        return rng.poisson(xbar, size)
+    elif rand == 'Gauss':
+        return rng.normal(size=size,loc=xbar,scale=sigma)
+    else:
+        return rng.uniform(size=size)
+
+def _sim_block(seedseq, rand, ntrials, npt, xbar, sigma, reduce):
+    """
+    Draws one block of trials for SimData with its own Generator; module level so process
+    pools can pickle it. Returns the block, its sum over trials, or (n, mean, M2) for 'mean'/'var'.
+    """
+    block = _draw(np.random.default_rng(seedseq), rand, (ntrials, npt), xbar, sigma)
+    if reduce is None:
+        return block
+    if reduce == 'sum':
+        return block.sum(axis=0)
+    mean = block.mean(axis=0)
+    return ntrials, mean, ((block - mean)**2).sum(axis=0)
+
+def _smooth_tile(tile, smooth_type, smooth_param, method, valid=None):
+    """
+    Smooths one tile of an image, with its validity mask if given; module level so process pools can pickle it.
+    """
+    d = MyData()
+    d.array = tile
+    if valid is not None:
+        d.SetValid('array', valid)
+    return d.smoother(smooth_type, smooth_param, method)
 
 if __name__=="__main__":
+    import matplotlib.pyplot as plt
     d = MyData()
     d.SimData(rand='Gauss', npt=50000, xbar=30, sigma=4)
     d.MyHistogram(which='y',bins=30, density=True, )
-    plt.show()
\ No newline at end of file
+    plt.show()
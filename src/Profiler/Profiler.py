@@ -0,0 +1,220 @@
+import os
+import time
+import inspect
+import json
+import marshal
+import threading
+import numpy as np
+
+# (owner class, attribute name, plain function, kind) of every method marked with hotpath
+_hotpaths = []
+
+class hotpath():
+    """
+    Marks a method as a hot path the Profiler can instrument.
+
+    Usage:
+        @hotpath('read')     # or 'write' or 'compute'
+        def GetFits(self, filename): ...
+
+    The method is left on its class unwrapped, so there is no overhead at all until
+    Profiler.enable() swaps in the timing wrappers.
+    """
+    kinds = ('read', 'write', 'compute')
+
+    def __init__(self, kind='compute'):
+        if kind not in hotpath.kinds:
+            raise ValueError(f'Invalid kind: {kind}, must be one of {", ".join(hotpath.kinds)}')
+        self.kind = kind
+
+    def __call__(self, func):
+        self.func = func
+        return self
+
+    def __set_name__(self, owner, name):
+        # called when the class body is created: register, then put the plain function back
+        _hotpaths.append((owner, name, self.func, self.kind))
+        setattr(owner, name, self.func)
+
+def _filename(sig, obj, args, kwargs):
+    # the file an I/O method worked on: its filename argument (or that argument's default),
+    # else the object's filename for methods without one
+    if 'filename' in sig.parameters:
+        bound = sig.bind(obj, *args, **kwargs)
+        bound.apply_defaults()
+        fn = bound.arguments['filename']
+    else:
+        fn = getattr(obj, 'filename', None)
+    return fn if isinstance(fn, str) else None
+
+def _nbytes(value):
+    # total size of the arrays in value (an array, or a dict/list/tuple of them)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(v.nbytes for v in value if isinstance(v, np.ndarray))
+    return 0
+
+class Profiler():
+    """
+    Collects call counts, wall time, bytes read/written and array sizes for the hotpath methods
+    of MyData, Instrument, Star and StarCatalog while enabled.
+
+    Hot paths may call each other (e.g. ReadExcelColumn -> ReadExcelColumns, tiled smoother ->
+    smoother). Each method's 'time' includes the hot paths it calls, 'self_time' does not, so
+    within a thread the self times add up to the elapsed time. File bytes are counted once,
+    by the outermost I/O call.
+    """
+    # attributes holding the data an I/O method loaded
+    _data_attrs = ['x', 'y', 'z', 'array']
+
+    def __init__(self):
+        self.enabled = False
+        self.log = None
+        self._lock = threading.Lock()
+        self._local = threading.local() # per-thread stack of [time spent in nested hot paths, is I/O]
+        self.reset()
+
+    def __repr__(self):
+        return f'Profiler object; enabled: {self.enabled}, {len(self.stats)} methods recorded'
+
+    def reset(self):
+        """
+        Discards everything recorded so far.
+        """
+        self.stats = {} # 'Class.method' -> dict of totals
+
+    def enable(self, log=None):
+        """
+        Starts instrumenting every hotpath method.
+
+        Arguments:
+            log: str, optional file to which one JSON record per call is appended
+        """
+        self.log = log
+        if self.enabled:
+            return
+        for owner, name, func, kind in _hotpaths:
+            setattr(owner, name, self._wrap(owner, func, kind))
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stops instrumenting; the original methods are restored, so disabled cost is zero.
+        """
+        for owner, name, func, kind in _hotpaths:
+            setattr(owner, name, func)
+        self.enabled = False
+        self.log = None
+
+    def __enter__(self):
+        self.enable(self.log)
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def _wrap(self, owner, func, kind):
+        profiler = self
+        key = f'{owner.__name__}.{func.__name__}'
+        sig = inspect.signature(func)
+
+        def wrapper(obj, *args, **kwargs):
+            stack = getattr(profiler._local, 'stack', None)
+            if stack is None:
+                stack = profiler._local.stack = []
+            #only the outermost I/O call counts the file's bytes
+            outer_io = kind != 'compute' and not any(io for _, io in stack)
+            if kind == 'read':
+                before = [id(getattr(obj, a, None)) for a in Profiler._data_attrs]
+            stack.append([0.0, kind != 'compute'])
+            t0 = time.perf_counter()
+            try:
+                result = func(obj, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - t0
+                nested = stack.pop()[0]
+                if stack:
+                    stack[-1][0] += elapsed
+
+            nread = nwritten = 0
+            if kind == 'compute':
+                nbytes = _nbytes(result)
+            else:
+                fn = _filename(sig, obj, args, kwargs) if outer_io else None
+                size = os.path.getsize(fn) if fn is not None and os.path.isfile(fn) else 0
+                if kind == 'read':
+                    nread = size
+                    #arrays returned, else the data attributes the call replaced
+                    nbytes = _nbytes(result) or sum(_nbytes(getattr(obj, a, None))
+                                                    for a, b in zip(Profiler._data_attrs, before)
+                                                    if id(getattr(obj, a, None)) != b)
+                else:
+                    nwritten = size
+                    nbytes = 0
+            profiler._record(key, func, kind, elapsed, elapsed - nested, nread, nwritten, nbytes)
+            return result
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def _record(self, key, func, kind, elapsed, self_time, nread, nwritten, nbytes):
+        with self._lock:
+            s = self.stats.get(key)
+            if s is None:
+                code = func.__code__
+                s = self.stats[key] = {'kind': kind, 'calls': 0, 'time': 0.0, 'self_time': 0.0, 'max_time': 0.0,
+                                       'bytes_read': 0, 'bytes_written': 0, 'array_bytes': 0,
+                                       'file': code.co_filename, 'line': code.co_firstlineno}
+            s['calls'] += 1
+            s['time'] += elapsed
+            s['self_time'] += self_time
+            s['max_time'] = max(s['max_time'], elapsed)
+            s['bytes_read'] += nread
+            s['bytes_written'] += nwritten
+            s['array_bytes'] += nbytes
+            if self.log is not None:
+                with open(self.log, 'a') as f:
+                    f.write(json.dumps({'method': key, 'kind': kind, 'time': elapsed, 'self_time': self_time, 'bytes_read': nread,
+                                        'bytes_written': nwritten, 'array_bytes': nbytes}) + '\n')
+
+    def report(self, top=10):
+        """
+        Returns a text summary of the top cost centres, by self time (time not spent in nested
+        hot paths); '%' is the share of the total self time, 'total s' includes nested hot paths.
+        """
+        rows = sorted(self.stats.items(), key=lambda kv: kv[1]['self_time'], reverse=True)[:top]
+        total = sum(s['self_time'] for s in self.stats.values())
+        lines = [f'{"method":<32} {"kind":<8} {"calls":>8} {"self s":>10} {"%":>6} {"total s":>10} {"mean ms":>10} '
+                 f'{"read MB":>10} {"written MB":>11} {"array MB":>10}']
+        for key, s in rows:
+            lines.append(f'{key:<32} {s["kind"]:<8} {s["calls"]:>8} {s["self_time"]:>10.4f} '
+                         f'{100*s["self_time"]/total if total else 0:>6.1f} {s["time"]:>10.4f} {1e3*s["time"]/s["calls"]:>10.3f} '
+                         f'{s["bytes_read"]/1e6:>10.2f} {s["bytes_written"]/1e6:>11.2f} {s["array_bytes"]/1e6:>10.2f}')
+        return '\n'.join(lines)
+
+    def to_json(self, filename):
+        """
+        Writes the per-method totals as JSON.
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.stats, f, indent=1)
+
+    def dump_stats(self, filename):
+        """
+        Writes the per-method totals in the cProfile/pstats format, so they can be loaded with
+        pstats.Stats(filename) or viewed with tools such as snakeviz.
+        """
+        stats = {}
+        for key, s in self.stats.items():
+            fn = (s['file'], s['line'], key)
+            stats[fn] = (s['calls'], s['calls'], s['self_time'], s['time'], {})
+        with open(filename, 'wb') as f:
+            marshal.dump(stats, f)
+
+# process-wide profiler
+profiler = Profiler()
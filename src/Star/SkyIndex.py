@@ -0,0 +1,102 @@
+import numpy as np
+
+def radec_to_xyz(ra, dec):
+    """
+    Converts right ascensions and declinations (degrees) to array(n, 3) of unit vectors.
+    """
+    ra = np.radians(np.asarray(ra, dtype=float))
+    dec = np.radians(np.asarray(dec, dtype=float))
+    cosdec = np.cos(dec)
+    return np.stack([cosdec*np.cos(ra), cosdec*np.sin(ra), np.sin(dec)], axis=-1)
+
+def _chord(sep):
+    # straight-line distance between unit vectors sep degrees apart on the sky
+    return 2*np.sin(np.radians(np.minimum(sep, 180.))/2)
+
+def _separation(chord):
+    # angular separation (degrees) of unit vectors chord apart
+    return np.degrees(2*np.arcsin(np.minimum(chord/2, 1.)))
+
+class SkyIndex():
+    """
+    Spatial index over sky positions: a KD-tree on unit vectors, so cone searches, nearest
+    neighbours and cross-matches take O(log n) per query instead of a scan of every object.
+    Separations are great-circle angles in degrees.
+    """
+    def __init__(self, ra, dec, leafsize=16):
+        """
+        Constructs a SkyIndex Object.
+
+        Arguments:
+            ra: array(n,) float, right ascension, degrees
+            dec: array(n,) float, declination, degrees
+            leafsize: int, KD-tree leaf size
+        """
+        from scipy.spatial import cKDTree
+        self.xyz = radec_to_xyz(ra, dec).reshape(-1, 3)
+        self.tree = cKDTree(self.xyz, leafsize=leafsize)
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """
+        Constructs a SkyIndex from a StarCatalog or a list of Star objects.
+        """
+        from Star.StarCatalog import StarCatalog
+        if not isinstance(catalog, StarCatalog):
+            catalog = StarCatalog.from_stars(catalog)
+        return cls(catalog.ra_deg, catalog.dec_deg)
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def __repr__(self):
+        return f'SkyIndex object: {len(self)} positions'
+
+    def cone(self, ra, dec, radius):
+        """
+        Finds the objects within radius of a pointing.
+
+        Arguments:
+            ra, dec: float, pointing, degrees; or arrays(m,) of pointings
+            radius: float, cone radius, degrees
+        Returns:
+            array of indices, sorted; for arrays of pointings, a list of such arrays
+        """
+        hits = self.tree.query_ball_point(radec_to_xyz(ra, dec), _chord(radius))
+        if np.ndim(ra) == 0:
+            return np.array(sorted(hits), dtype=np.intp)
+        return [np.array(sorted(h), dtype=np.intp) for h in hits]
+
+    def nearest(self, ra, dec, k=1, max_sep=None):
+        """
+        Finds the k nearest objects to each position.
+
+        Arguments:
+            ra, dec: float or array(m,) float, degrees
+            k: int, number of neighbours
+            max_sep: float, degrees; neighbours farther than this are reported with index len(self)
+                and separation inf
+        Returns:
+            sep: separations, degrees, shape of ra (with a trailing k axis if k > 1)
+            idx: indices into the index, same shape
+        """
+        bound = np.inf if max_sep is None else _chord(max_sep)
+        chord, idx = self.tree.query(radec_to_xyz(ra, dec), k=k, distance_upper_bound=bound)
+        # _separation would clip the infinite chords of missing neighbours to 180 degrees
+        return np.where(idx == len(self), np.inf, _separation(chord))[()], idx
+
+    def crossmatch(self, ra, dec, radius):
+        """
+        Matches each position to its nearest object in the index within radius.
+
+        Arguments:
+            ra, dec: array(m,) float, positions of the other catalog, degrees
+            radius: float, match radius, degrees
+        Returns:
+            other: array of indices into ra/dec that have a match
+            idx: array of indices of their matches in the index
+            sep: array of separations, degrees
+        """
+        sep, idx = self.nearest(np.atleast_1d(ra), np.atleast_1d(dec), max_sep=radius)
+        other = np.flatnonzero(idx < len(self))
+        return other, idx[other], sep[other]
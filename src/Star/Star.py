@@ -5,6 +5,16 @@ if __name__ == "__main__":
     sys.path.insert(0, r'ASTR3800\src')
 
 from Model.BlackBody import BlackBody
+from Profiler.Profiler import hotpath
+
+def radius_from_luminosity(lum, teff):
+    """
+    Infers the radius (in solar radii) of a blackbody of luminosity lum (W) and temperature teff (K),
+    R = (L/(4 pi sigma_sb T^4))^(1/2). Arguments may be arrays.
+    """
+    sb =  5.67037e-08 #stefan boltzmann const. W / (K4 m2)
+    sun_r_m = 6.957e+08 # m
+    return np.sqrt(lum/(4*np.pi*sb*np.power(teff,4)))/sun_r_m
 
 class Star():
     # required star properties the Star object keeps track of
@@ -103,17 +113,58 @@ class Star():
 
     def luminosity_spectrum(self, lmbda=None):
         bb = BlackBody(name=None, temp=self.teff)
-        spec = bb.flux(lmbda=lmbda)
+        spec = bb.cached_flux(lmbda=lmbda)
         sa = self.surface_area()
         lum = spec*sa
         return lum
 
+    @hotpath('compute')
     def flux_spectrum(self, lmbda=None):
         lum = self.luminosity_spectrum(lmbda=lmbda)
         dist = self.distance_m()
         flux = lum/(4*np.pi*dist**2)
         return flux
 
+    def propagate(self, quantity, sigma, nsamples=10**6, relative=False, lmbda=None, seed=None,
+                  chunksize=None, keep_samples=False):
+        """
+        Propagates uncertainties in the star's properties into a derived quantity by Monte Carlo,
+        alongside the first-order (linearized) estimate.
+
+        Arguments:
+            quantity: str, one of 'luminosity', 'surface_flux', 'flux_spectrum', 'luminosity_spectrum',
+                'Wien' or 'radius' (solar radii, inferred from luminosity and teff as R = (L/(4 pi sigma_sb T^4))^(1/2))
+            sigma: dict, standard deviation of each uncertain property: 'teff', 'radius', 'distance', 'mass';
+                for quantity 'radius', 'luminosity' (W) instead of 'radius'. Properties not given are held fixed.
+            nsamples: int, number of Monte Carlo samples
+            relative: bool, True if sigma values are fractions of the property values
+            lmbda: array(nlam,) float, wavelengths (m) for the spectra
+            seed: int or np.random.SeedSequence, for reproducible samples
+            chunksize: int, samples evaluated per batch; default: about 2**20 values per batch
+            keep_samples: bool, also return the samples and their percentiles; the samples take
+                nsamples values (nsamples*nlam for spectra) of memory, otherwise memory stays at one batch
+        Returns:
+            dict with keys:
+                quantity: str
+                nsamples: int
+                mean, std: float or array(nlam,), Monte Carlo mean and standard deviation
+                percentiles: dict of percentile -> value (2.5, 16, 50, 84, 97.5), None unless keep_samples
+                samples: array(nsamples,) or array(nsamples, nlam), None unless keep_samples
+                linear_value, linear_std: first-order estimate, the quantity at the property values and
+                    sqrt(sum((d quantity/d property * sigma)^2))
+        """
+        values = dict([(prop, np.array([getattr(self, prop)], dtype=float)) for prop in Star._starpropfloats])
+        if quantity == 'radius':
+            values['luminosity'] = np.array([self.luminosity()])
+        seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        result = _propagate(quantity, values, sigma, nsamples, relative, lmbda, [seed], chunksize, keep_samples)
+        for key in ['mean', 'std', 'samples', 'linear_value', 'linear_std']:
+            if result[key] is not None:
+                result[key] = result[key][0]
+        if result['percentiles'] is not None:
+            result['percentiles'] = dict([(p, v[0]) for p, v in result['percentiles'].items()])
+        return result
+
     def to_dict(self):
         """
         Returns a dict of star properties.
@@ -138,6 +189,107 @@ class Star():
         # #update the model with the flux values
         # self.inst_flux_lambda = inst_flux
 
+# derived quantities _propagate can evaluate; 'radius' is inferred from luminosity and teff
+_derived = ['luminosity', 'surface_flux', 'flux_spectrum', 'luminosity_spectrum', 'Wien', 'radius']
+
+def _propagate(quantity, values, sigma, nsamples, relative, lmbda, seeds, chunksize, keep_samples):
+    """
+    Monte Carlo and first-order uncertainty propagation for a batch of stars (see Star.propagate),
+    evaluated for all of them at once.
+
+    Arguments:
+        values: dict of property -> array(nstars,) float; 'luminosity' too if quantity is 'radius'
+        sigma: dict of property -> float or array(nstars,)
+        seeds: list of np.random.SeedSequence, one per star, so every star draws its own samples
+    Returns:
+        Star.propagate's dict, with a leading star axis on every array
+    """
+    from Star.StarCatalog import StarCatalog
+
+    if quantity not in _derived:
+        raise ValueError(f'Invalid quantity: {quantity}, must be one of {", ".join(_derived)}')
+    #radius is not an input of the radius inferred from luminosity and teff
+    inputs = Star._starpropfloats if quantity != 'radius' else [p for p in Star._starpropfloats if p != 'radius'] + ['luminosity']
+    for prop in sigma:
+        if prop not in inputs:
+            raise ValueError(f'Invalid sigma property for {quantity}: {prop}, must be one of {", ".join(inputs)}')
+    if nsamples < 1:
+        raise ValueError(f'Invalid nsamples: {nsamples}, must be at least 1')
+
+    nstars = len(values['teff'])
+    scale = dict([(prop, np.broadcast_to(np.asarray(s, dtype=float)*(np.abs(values[prop]) if relative else 1.), (nstars,)))
+                  for prop, s in sigma.items()])
+    if lmbda is None and quantity.endswith('_spectrum'):
+        lmbda = BlackBody(name=None, temp=values['teff']).lmbda
+
+    def evaluate(cols):
+        # quantity for each row of cols, a dict of property arrays
+        cat = object.__new__(StarCatalog)
+        for prop in Star._starpropfloats:
+            setattr(cat, prop, cols[prop])
+        if quantity == 'radius':
+            return radius_from_luminosity(cols['luminosity'], cols['teff'])
+        if quantity.endswith('_spectrum'):
+            return getattr(cat, quantity)(lmbda=lmbda)
+        return getattr(cat, quantity)()
+
+    #first order: central differences about the property values, every star and step in one batch
+    uncertain = [prop for prop in scale if np.any(scale[prop] != 0)]
+    k = len(uncertain)
+    cols = dict([(prop, np.repeat(v[:, np.newaxis], 2*k+1, axis=1)) for prop, v in values.items()])
+    steps = {}
+    for i, prop in enumerate(uncertain):
+        h = np.where(values[prop] != 0, 1e-6*np.abs(values[prop]), 1e-6*scale[prop])
+        steps[prop] = h = np.where(h != 0, h, 1e-6)
+        cols[prop][:, 2*i+1] += h
+        cols[prop][:, 2*i+2] -= h
+    f = evaluate(dict([(prop, c.ravel()) for prop, c in cols.items()]))
+    f = f.reshape((nstars, 2*k+1) + f.shape[1:])
+    linear_value = f[:, 0]
+    linear_var = np.zeros(linear_value.shape)
+    for i, prop in enumerate(uncertain):
+        d = (f[:, 2*i+1] - f[:, 2*i+2])/_per_star(2*steps[prop], f.ndim-1)
+        linear_var += (d*_per_star(scale[prop], f.ndim-1))**2
+
+    #Monte Carlo, chunksize samples of every star at a time; each star draws from its own stream
+    width = len(lmbda) if quantity.endswith('_spectrum') else 1
+    if chunksize is None:
+        chunksize = max(1, 2**20//(width*nstars))
+    rngs = [np.random.default_rng(ss) for ss in seeds]
+    samples = np.empty((nstars, nsamples) + linear_value.shape[1:]) if keep_samples else None
+    n = 0
+    for start in range(0, nsamples, chunksize):
+        m = min(chunksize, nsamples-start)
+        z = np.stack([rng.standard_normal((k, m)) for rng in rngs], axis=1) # (k, nstars, m)
+        cols = dict([(prop, np.repeat(v[:, np.newaxis], m, axis=1)) for prop, v in values.items()])
+        for i, prop in enumerate(uncertain):
+            cols[prop] = cols[prop] + scale[prop][:, np.newaxis]*z[i]
+        block = evaluate(dict([(prop, c.ravel()) for prop, c in cols.items()]))
+        block = block.reshape((nstars, m) + block.shape[1:])
+        if keep_samples:
+            samples[:, start:start+m] = block
+        #merge the block moments into the running ones (Chan et al.)
+        block_mean = block.mean(axis=1)
+        block_m2 = ((block - block_mean[:, np.newaxis])**2).sum(axis=1)
+        if n == 0:
+            mean, m2 = block_mean, block_m2
+        else:
+            delta = block_mean - mean
+            mean = mean + delta*(m/(n+m))
+            m2 = m2 + block_m2 + delta**2*(n*m/(n+m))
+        n += m
+
+    pct = [2.5, 16, 50, 84, 97.5]
+    return {'quantity': quantity, 'nsamples': nsamples,
+            'mean': mean, 'std': np.sqrt(m2/(n-1)) if n > 1 else np.zeros_like(mean),
+            'percentiles': dict(zip(pct, np.percentile(samples, pct, axis=1))) if keep_samples else None,
+            'samples': samples,
+            'linear_value': linear_value, 'linear_std': np.sqrt(linear_var)}
+
+def _per_star(a, ndim):
+    # array(nstars,) shaped to broadcast against arrays(nstars, ...) of ndim dimensions
+    return a.reshape((-1,) + (1,)*(ndim-1))
+
 if __name__ == "__main__":
     mintaka = Star('Mintaka', ra='05:32:00.4009', dec='-00:17:56.7424',
             distance=380, mass= 24, teff=29500, radius=16.5)
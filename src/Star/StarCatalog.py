@@ -0,0 +1,339 @@
+import numpy as np
+
+from Model.BlackBody import BlackBody
+from Star.Star import Star, _propagate
+from Profiler.Profiler import hotpath
+
+def sexagesimal_to_rad(values, hours=False, chunksize=65536):
+    """
+    Parses a column of sexagesimal strings into radians (see sexagesimal_to_deg).
+
+    Arguments:
+        values: array-like of str, '[+-]dd:mm:ss.sss' (or 'hh:mm:ss.sss' if hours); trailing fields may be omitted
+        hours: bool, True if the values are hours of right ascension
+    Returns:
+        array float, radians, same shape as values
+    """
+    return np.radians(sexagesimal_to_deg(values, hours=hours, chunksize=chunksize))
+
+def sexagesimal_to_deg(values, hours=False, chunksize=65536):
+    """
+    Parses a column of sexagesimal strings into decimal degrees. The characters of the whole column are
+    decoded at once as an array of codes, chunksize strings at a time, rather than string by string.
+
+    Arguments:
+        values: array-like of str, '[+-]dd:mm:ss.sss' (or 'hh:mm:ss.sss' if hours); trailing fields may be omitted
+        hours: bool, True if the values are hours of right ascension
+    Returns:
+        array float, degrees, same shape as values
+    """
+    v = np.char.strip(np.atleast_1d(np.asarray(values, dtype=str)))
+    shape = np.shape(values)
+    v = v.ravel()
+    w = max(v.dtype.itemsize//4, 1)
+    codes = v.view(np.uint32).reshape(len(v), w) # one UCS4 code per character, 0 padded
+    pos = np.arange(w, dtype=np.int16)
+    # weight[field, w+k]: value of a digit k places before (k>=0) or -k places after (k<0) its field's decimal point
+    weight = np.array([1., 1/60., 1/3600.])[:, np.newaxis]*10.**np.arange(-w, w+1)
+
+    deg = np.empty(len(v))
+    for start in range(0, len(v), chunksize):
+        c = codes[start:start+chunksize]
+        colon = c == ord(':')
+        dot = c == ord('.')
+        digit = (c >= ord('0')) & (c <= ord('9'))
+        field = np.cumsum(colon, axis=1, dtype=np.int8)
+
+        #nearest '.', ':' or end after each character, and nearest '.' or ':' at or before it
+        after = np.minimum.accumulate(np.where(dot | colon | (c == 0), pos, w)[:, ::-1], axis=1)[:, ::-1]
+        before = np.maximum.accumulate(np.where(dot | colon, pos, -1), axis=1)
+        frac = np.take_along_axis(dot, np.maximum(before, 0), axis=1) & (before >= 0)
+
+        ok = digit | colon | dot | (c == 0) | (((c == ord('-')) | (c == ord('+'))) & (pos == 0))
+        bad = ~ok.all(axis=1) | (field[:, -1] > 2) | (dot[:, 1:] & frac[:, :-1]).any(axis=1)
+        for f in range(3):
+            #every field present needs at least one digit: rejects '', '-', '12::3' and '12:'
+            bad |= (field[:, -1] >= f) & ~(digit & (field == f)).any(axis=1)
+        if bad.any():
+            raise ValueError(f'Invalid sexagesimal value: {v[start:start+chunksize][bad][0]}')
+
+        place = np.where(frac, before - pos, after - pos - 1)
+        value = (np.where(digit, c - ord('0'), 0)*weight[field, w + place]).sum(axis=1)
+        value[c[:, 0] == ord('-')] *= -1
+        deg[start:start+chunksize] = value
+
+    if hours:
+        deg *= 15.
+    return deg.reshape(shape)
+
+def _is_fits(filename):
+    return filename.lower().endswith(('.fits', '.fit', '.fts', '.fits.gz'))
+
+def _scan_csv(filename, start=0):
+    """
+    Scans the lines of a CSV file without parsing them, the way pandas reads it: blank (or whitespace only)
+    lines are skipped and the first line left is the header.
+    Returns (number of data rows, line number of the header, line number of data row start).
+    """
+    nlines = nrows = 0 # lines and nonblank lines so far
+    header = line = None
+    partial = False # non-whitespace seen on the unfinished line at the end of the last buffer
+
+    def found(nonblank):
+        nonlocal nrows, header, line
+        if header is None and len(nonblank):
+            header = nonblank[0]
+        k = start + 1 - nrows
+        if line is None and 0 <= k < len(nonblank):
+            line = nonblank[k]
+        nrows += len(nonblank)
+
+    with open(filename, 'rb') as f:
+        for buf in iter(lambda: f.read(2**24), b''):
+            b = np.frombuffer(buf, dtype=np.uint8)
+            ink = np.cumsum(~np.isin(b, np.frombuffer(b' \t\r\n', dtype=np.uint8)))
+            ends = ink[b == ord('\n')]
+            lines = np.diff(ends, prepend=0) > 0
+            if len(lines):
+                lines[0] |= partial
+                partial = ink[-1] > ends[-1]
+            else:
+                partial |= ink[-1] > 0
+            found(np.flatnonzero(lines) + nlines)
+            nlines += len(lines)
+    if partial:
+        found([nlines]) # no newline after the last row
+        nlines += 1
+    if header is None:
+        return 0, 0, 0
+    return nrows - 1, int(header), int(line if line is not None else nlines)
+
+def count_rows(filename, ext=1):
+    """
+    Returns the number of stars in a catalog file (CSV with a header line, or a FITS table in HDU ext)
+    without parsing it. Blank lines in a CSV file are not rows, as in iter_catalog.
+    """
+    if _is_fits(filename):
+        from astropy.io import fits
+        return fits.getheader(filename, ext)['NAXIS2']
+    return _scan_csv(filename)[0]
+
+def iter_catalog(filename, chunksize=100000, start=0, ext=1):
+    """
+    Reads a star catalog chunksize rows at a time, so catalogs of any size can be processed in bounded memory.
+
+    Arguments:
+        filename: str, CSV file with a header line, or FITS file with a table in HDU ext; columns
+            ra, dec, distance, radius, mass, teff (see StarCatalog) and optionally name
+        chunksize: int, rows per chunk
+        start: int, first row to read
+    Yields:
+        StarCatalog of at most chunksize rows; stars without a name column are named by row number
+    """
+    def catalog(cols, first):
+        n = len(cols['teff'])
+        name = cols.pop('name', None)
+        if name is None:
+            name = np.arange(first, first+n).astype(str)
+        return StarCatalog(name, **cols)
+
+    if _is_fits(filename):
+        from astropy.io import fits
+        with fits.open(filename, memmap=True) as hdul:
+            data = hdul[ext].data
+            names = [c.lower() for c in data.columns.names]
+            wanted = [c for c in ['name'] + StarCatalog._starprops if c in names]
+            for first in range(start, len(data), chunksize):
+                rows = data[first:first+chunksize]
+                yield catalog(dict([(c, np.asarray(rows[c])) for c in wanted]), first)
+        return
+
+    import pandas as pd
+    strcols = {'name': str, 'ra': str, 'dec': str}
+    skiprows = None
+    if start > 0:
+        #skip the lines up to data row start, counting blank lines as pandas does
+        _, header, line = _scan_csv(filename, start)
+        skiprows = range(header+1, line)
+    with pd.read_csv(filename, skipinitialspace=True, dtype=strcols, chunksize=chunksize,
+                     skiprows=skiprows) as reader:
+        first = start
+        for df in reader:
+            df.columns = [c.strip().lower() for c in df.columns]
+            yield catalog(dict([(c, df[c].to_numpy()) for c in ['name'] + StarCatalog._starprops if c in df]), first)
+            first += len(df)
+
+class StarCatalog():
+    """
+    Columnar collection of stars. Each Star property is held as a numpy array,
+    and the Star methods are evaluated over the whole catalog at once.
+    """
+    # columns the catalog keeps track of; same as the Star properties
+    _starprops = Star._starprops
+    _starpropfloats = Star._starpropfloats
+    _columns = ['name'] + Star._starprops + ['ra_deg', 'dec_deg']
+
+    def __init__(self, name, **kwargs):
+        """
+        Constructs a StarCatalog Object.
+
+        Arguments:
+            name: array(n,) str, star names
+            ra: array(n,) str, right ascension (J2000) hh:mm:ss.ssss
+            dec: array(n,) str, declination (J2000) dd:mm:ss.sssss
+            distance: array(n,) float, pc
+            radius: array(n,) float, soloar radii
+            mass: array(n,) float, solar masses
+            teff: array(n,) float, effective temperature, K
+        """
+        self.name = np.asarray(name, dtype=str)
+        n = len(self.name)
+
+        #required properties; will bomb if property not supplied
+        for prop in StarCatalog._starprops:
+            setattr(self, prop, np.asarray(kwargs.pop(prop)))
+
+        #make sure the props that are supposed to be floats are floats
+        for prop in StarCatalog._starpropfloats:
+            setattr(self, prop, np.asarray(getattr(self, prop), dtype=float))
+
+        for prop in StarCatalog._starprops:
+            if getattr(self, prop).shape != (n,):
+                raise ValueError(f'Column {prop} has shape {getattr(self, prop).shape}, expected ({n},)')
+
+        self.ra_deg = sexagesimal_to_deg(self.ra, hours=True)
+        self.dec_deg = sexagesimal_to_deg(self.dec)
+
+    @classmethod
+    def from_stars(cls, stars):
+        """
+        Constructs a StarCatalog from a list of Star objects.
+        """
+        cols = dict([(prop, [getattr(s, prop) for s in stars]) for prop in Star._starprops])
+        return cls([s.name for s in stars], **cols)
+
+    def _view(self, idx):
+        # new catalog sharing (for slices) or copying (for index arrays) the columns
+        cat = object.__new__(type(self))
+        for col in StarCatalog._columns:
+            setattr(cat, col, getattr(self, col)[idx])
+        return cat
+
+    def __len__(self):
+        return len(self.name)
+
+    def __getitem__(self, idx):
+        """
+        Integer index returns a Star; slices, boolean masks and index arrays return a StarCatalog.
+        """
+        if isinstance(idx, (int, np.integer)):
+            return Star(str(self.name[idx]), **dict([(prop, getattr(self, prop)[idx]) for prop in StarCatalog._starprops]))
+        return self._view(idx)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return f'StarCatalog object: {len(self)} stars'
+
+    def to_stars(self):
+        """
+        Returns a list of Star objects, one per catalog row.
+        """
+        return list(self)
+
+    def radius_m(self):
+        """
+        Returns star radii in m.
+        """
+        sun_r_m = 6.957e+08 # m
+        return self.radius*sun_r_m
+
+    def distance_m(self):
+        """
+        Returns distances to stars in m.
+        """
+        m_per_pc = 3.085677581491367e+16
+        return self.distance*m_per_pc
+
+    def surface_area(self):
+        """
+        Returns surface areas of stars in m^2.
+        """
+        r = self.radius_m()
+        return 4*np.pi*r**2
+
+    def mass_g(self):
+        """
+        Returns star masses in kg.
+        """
+        sun_m_kg = 1.98841e+30 #kg
+        return self.mass*sun_m_kg
+
+    def Wien(self):
+        """
+        Computes and returns wavelengths (in nm) of maximum flux given stars' temperatures
+        """
+        nm_per_meter = 1e9
+        lmbda_max = BlackBody(name=None, temp=self.teff).Wien()
+        return lmbda_max*nm_per_meter
+
+    def surface_flux(self):
+        """
+        Computes flux on the surface of the stars using StefanBoltzmann law
+        Returns:
+            flux: array(n,) float, W m^-2
+        """
+        sb =  5.67037e-08 #stefan boltzmann const. W / (K4 m2)
+        return sb*np.power(self.teff,4)
+
+    def luminosity(self):
+        """
+        Computes and returns stars' luminosities (in Watts) from their radii and temperatures
+        """
+        return self.surface_flux()*self.surface_area()
+
+    def luminosity_spectrum(self, lmbda=None):
+        """
+        Returns array(n, nlam) of luminosity spectra, one row per star.
+        """
+        bb = BlackBody(name=None, temp=self.teff)
+        lum = bb.flux(lmbda=lmbda)
+        lum *= self.surface_area()[:, np.newaxis]
+        return lum
+
+    @hotpath('compute')
+    def flux_spectrum(self, lmbda=None):
+        """
+        Returns array(n, nlam) of flux spectra at the observer, one row per star.
+        """
+        flux = self.luminosity_spectrum(lmbda=lmbda)
+        dist = self.distance_m()
+        flux /= (4*np.pi*dist**2)[:, np.newaxis]
+        return flux
+
+    def sky_index(self):
+        """
+        Returns a SkyIndex over the catalog's positions, built on first use.
+        """
+        from Star.SkyIndex import SkyIndex
+        index = getattr(self, '_sky_index', None)
+        if index is None:
+            index = self._sky_index = SkyIndex(self.ra_deg, self.dec_deg)
+        return index
+
+    def propagate(self, quantity, sigma, nsamples=10**6, relative=False, lmbda=None, seed=None,
+                  chunksize=None, keep_samples=False):
+        """
+        Star.propagate for every star in the catalog at once, all stars' samples evaluated together
+        chunksize samples at a time. sigma values may be arrays(n,), one per star. Each star draws
+        from its own stream, spawned from seed.
+        Returns Star.propagate's dict with a leading star axis on every array (samples: array(n, nsamples[, nlam])).
+        """
+        values = dict([(prop, np.asarray(getattr(self, prop), dtype=float)) for prop in StarCatalog._starpropfloats])
+        if quantity == 'radius':
+            values['luminosity'] = self.luminosity()
+        seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        return _propagate(quantity, values, sigma, nsamples, relative, lmbda, seed.spawn(len(self)),
+                          chunksize, keep_samples)
@@ -0,0 +1,27 @@
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from MyData.MyData import MyData
+
+def test_mydata_round_trip_over_mapped_file(tmp_path):
+    #load memory-mapped, edit, save over the same file, reload
+    fn = str(tmp_path / 'roundtrip.mydata')
+    d = MyData()
+    d.x = np.arange(5.); d.nx = 5
+    d.array = np.arange(12.).reshape(3, 4)
+    d.SetValid('x', np.arange(5) != 2)
+    d.WriteMyData(fn)
+
+    d = MyData()
+    d.ReadMyData(fn, mmap=True)
+    d.x[0] = 100
+    d.WriteMyData(fn)
+
+    e = MyData()
+    e.ReadMyData(fn, mmap=False)
+    assert e.x.tolist() == [100., 1., 2., 3., 4.]
+    assert e.array.tolist() == np.arange(12.).reshape(3, 4).tolist()
+    assert e.Valid('x').tolist() == [True, True, False, True, True]
+    assert e.Valid('array') is None